@@ -8,21 +8,103 @@ to maintain a clean song library.
 import os
 import argparse
 import logging
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 from termcolor import colored
 
 from libs.reader_file import FileReader
 from libs.db_sqlite import SqliteDatabase
 from libs.config import get_config
-from libs.utils import grouper
 import libs.fingerprint as fingerprint
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+# Minimum number of aligned hashes for a song to count as a duplicate
+DUPLICATE_CONFIDENCE = 1000
+
+# Offset differences are biased into the low 32 bits of a packed
+# (song_id, diff) key so a single int64 array can be tallied at once.
+DIFF_BIAS = 2**31
+DIFF_BITS = 32
+
+# Files smaller than this cannot hold enough audio to fingerprint
+MIN_FILE_SIZE = 1024
+
+# Files being fingerprinted ahead of the database writer, per worker; this
+# bounds how many finished results wait in memory to be stored
+FILES_IN_FLIGHT_PER_WORKER = 2
+
+# Column order of the song records returned by the database
+SONG_COLUMNS = (
+    "id",
+    "name",
+    "filehash",
+    "title",
+    "artist",
+    "album",
+    "genre",
+    "track",
+    "duration",
 )
 
 
+class SongIndex:
+    """
+    In-memory lookup of the songs already in the database.
+
+    It is loaded once per run, so the duplicate checks for every file are
+    dictionary lookups instead of SQL round trips. Tag lookups follow
+    Database.get_song_by_tags: every tag that is set has to match.
+    """
+
+    def __init__(self, database):
+        """
+        Loads every song from the database.
+
+        Args:
+            database (Database): An active database connection object.
+        """
+        self._by_filehash = {}
+        self._by_title = defaultdict(list)
+        for song in database.get_all_songs():
+            self.add(song)
+
+    def add(self, song):
+        """Adds a song record, as returned by the database, to the index."""
+        fields = dict(zip(SONG_COLUMNS, song))
+        self._by_filehash[fields["filehash"]] = song
+        self._by_title[fields["title"]].append((fields, song))
+
+    def filehashes(self):
+        """Returns the file hashes of every indexed song."""
+        return frozenset(self._by_filehash)
+
+    def get_song_by_filehash(self, filehash):
+        """Returns the song with the given file hash, or None."""
+        return self._by_filehash.get(filehash)
+
+    def get_song_by_tags(self, tag):
+        """Returns the first song whose columns match every set tag, or None."""
+        criteria = {key: tag.get(key) for key in SONG_COLUMNS[4:] if tag.get(key)}
+        if "duration" in criteria:
+            criteria["duration"] = round(criteria["duration"], 1)
+        if "track" in criteria:
+            criteria["track"] = _as_integer(criteria["track"])
+
+        for fields, song in self._by_title.get(tag["title"], ()):
+            if all(fields[key] == value for key, value in criteria.items()):
+                return song
+        return None
+
+
+def _as_integer(value):
+    """Converts numeric text the way SQLite's INT column affinity does."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
 def parse_arguments():
     """Parse command-line arguments."""
     parser = argparse.ArgumentParser(description="Collect fingerprints of songs.")
@@ -32,48 +114,102 @@ def parse_arguments():
         choices=["Yes", "No"],
         help="Enable signature check to find acoustically similar songs (default: No)",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes used to fingerprint files (default: CPU count)",
+    )
     return parser.parse_args()
 
 
-def find_matches(samples, fs, database, channel_hashes=None):
-    """Finds matches of the provided samples against the database."""
-    # Use channel_hashes if provided, otherwise calculate them
-    hashes_to_match = (
-        channel_hashes
-        if channel_hashes is not None
-        else list(fingerprint.fingerprint(samples, fs=fs))
-    )
-    return return_matches(hashes_to_match, database)
+def list_new_files(mp3_directory, scanned_files, known_filehashes):
+    """
+    Lists the .mp3 files that have not yet been processed in their current state.
+
+    A processed file is listed again once the library song it was stored as,
+    or found to duplicate, is no longer in the database.
 
+    Args:
+        mp3_directory (str): The directory to scan.
+        scanned_files (dict): Maps processed file paths to their
+                              (mtime, size, filehash).
+        known_filehashes (frozenset): The file hashes of the library songs.
 
-def return_matches(hashes, database):
-    """Returns matches for the provided hashes."""
-    mapper = {str(hash_val).upper(): offset for hash_val, offset in hashes}
-    values = mapper.keys()
+    Returns:
+        list: (path, mtime, size) tuples of the new or changed files, sorted
+              by path.
+    """
+    new_files = []
+    with os.scandir(mp3_directory) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(".mp3") or not entry.is_file():
+                continue
+            # DirEntry caches the stat result, so this costs no extra syscall
+            # on most platforms
+            stat = entry.stat()
+            if stat.st_size < MIN_FILE_SIZE:
+                continue
+            mtime, size, filehash = scanned_files.get(entry.path, (None,) * 3)
+            if (mtime, size) == (stat.st_mtime, stat.st_size) and (
+                filehash in known_filehashes
+            ):
+                continue
+            new_files.append((entry.path, stat.st_mtime, stat.st_size))
+    return sorted(new_files)
+
+
+# File hashes already in the database, set once in each worker process
+_known_filehashes = frozenset()
+
+
+def init_worker(known_filehashes):
+    """Prepares a worker process and stores the file hashes known at startup."""
+    global _known_filehashes  # pylint: disable=global-statement
+    _known_filehashes = known_filehashes
+    # The pool already runs one worker per CPU
+    fingerprint.FFT_WORKERS = 1
+
+
+def compute_fingerprints(file_path):
+    """
+    Reads an audio file and fingerprints each of its channels.
 
-    for value_chunk in grouper(values, 1000):
-        # Convert the filter object from grouper into a list
-        split_values = list(value_chunk)
+    This runs in a worker process, so it only does the CPU-bound decoding
+    and fingerprinting and never touches the database.
 
-        # Skip empty chunks
-        if not split_values:
-            continue
+    Returns:
+        dict: The properties returned by FileReader.parse_audio, with the raw
+              "channels" replaced by a "channel_hashes" list holding a list of
+              (hash, offset) pairs per channel, or an empty dictionary if the
+              file is unreadable. Files whose hash is already known are not
+              decoded; only their "songname" and "file_hash" are returned.
+    """
+    reader = FileReader(file_path)
+    file_hash = reader.parse_file_hash()
+    if file_hash in _known_filehashes:
+        songname = os.path.splitext(os.path.basename(file_path))[0]
+        return {"songname": songname, "file_hash": file_hash}
+
+    audio = reader.parse_audio()
+    if audio:
+        audio["channel_hashes"] = [
+            fingerprint.fingerprint_channel(channel, fs=audio["Fs"])
+            for channel in audio.pop("channels")
+        ]
+    return audio
+
+
+def find_matches(channel_hashes, database):
+    """
+    Finds matches of the provided channel hashes against the database.
 
-        query = """
-            SELECT upper(hash), song_fk, offset
-            FROM fingerprints
-            WHERE upper(hash) IN (%s)
-        """
-        query %= ", ".join("?" * len(split_values))
-
-        db_results = database.execute_all(query, split_values)
-        for hash_val, sid, db_offset in db_results:
-            offset_diff = (
-                int.from_bytes(db_offset, byteorder="little")
-                if isinstance(db_offset, bytes)
-                else int(db_offset)
-            )
-            yield (sid, offset_diff - mapper[str(hash_val)])
+    Returns:
+        np.ndarray: An (N, 3) int64 array of (song_id, offset difference,
+                    match count) rows.
+    """
+    matches = database.get_match_counts(channel_hashes)
+    return np.array(matches, dtype=np.int64).reshape(-1, 3)
 
 
 def align_matches(matches, database):
@@ -81,118 +217,186 @@ def align_matches(matches, database):
     Aligns matches and determines if a high-confidence match exists.
     Returns the matched song and the confidence score.
     """
-    diff_counter = {}
-    largest_count = 0
-    song_id = -1
-
-    for sid, diff in matches:
-        diff_counter.setdefault(diff, {})
-        diff_counter[diff].setdefault(sid, 0)
-        diff_counter[diff][sid] += 1
-
-        if diff_counter[diff][sid] > largest_count:
-            largest_count = diff_counter[diff][sid]
-            song_id = sid
-
-    if largest_count >= 1000:
+    if not len(matches):
+        return None, 0
+
+    # Pack each (song_id, diff) pair into one int64 key and sum the counts
+    # of every channel for the same key in a single vectorized pass.
+    keys = (matches[:, 0] << DIFF_BITS) | (matches[:, 1] + DIFF_BIAS)
+    values, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=matches[:, 2])
+    best = counts.argmax()
+    largest_count = int(counts[best])
+
+    if largest_count >= DUPLICATE_CONFIDENCE:
+        song_id = int(values[best] >> DIFF_BITS)
         song = database.get_song_by_id(song_id)
         return song, largest_count
 
     return None, 0
 
 
-def fingerprint_song(audio, database, check_signature):
-    """Fingerprints a single song and stores it in the database."""
+def fingerprint_song(audio, database, song_index, check_signature):
+    """
+    Fingerprints a single song and stores it in the database.
+
+    Returns:
+        tuple: The library song record the file was stored as or found to
+               duplicate, and True if the song was added, False if it was
+               skipped.
+    """
     # Check if song is already in the database by hash or metadata
-    if song_by_hash := database.get_song_by_filehash(audio["file_hash"]):
+    if song_by_hash := song_index.get_song_by_filehash(audio["file_hash"]):
         logging.warning(
             "Skipping '%s' (already in DB with hash for song: %s)",
             audio["songname"],
             song_by_hash[1],
         )
-        return
+        return song_by_hash, False
 
     tag = audio["metadata"]
     if tag.get("title"):
-        if song_by_tags := database.get_song_by_tags(
-            tag["title"],
-            tag.get("artist"),
-            tag.get("album"),
-            tag.get("genre"),
-            tag.get("duration"),
-            tag.get("track"),
-        ):
+        if song_by_tags := song_index.get_song_by_tags(tag):
             logging.warning(
                 "Skipping '%s' (metadata matches existing song: '%s')",
                 audio["songname"],
                 song_by_tags[1],
             )
-            return
+            return song_by_tags, False
+
+    # Nothing can be a duplicate while the library is still empty
+    check_signature = check_signature == "Yes" and database.has_fingerprints()
 
-    # Generate audio fingerprints
+    # Collect the audio fingerprints computed by the worker
     all_channel_hashes = set()
+    all_channel_hashes_add = all_channel_hashes.add
     found_matches = []
 
-    for channel in audio["channels"]:
-        channel_hashes = list(fingerprint.fingerprint(channel, fs=audio["Fs"]))
-        all_channel_hashes.update(channel_hashes)
-
+    for channel_hashes in audio["channel_hashes"]:
         # If signature check is enabled, find matches for the current channel
-        if check_signature == "Yes":
-            found_matches.extend(
-                find_matches(channel, audio["Fs"], database, channel_hashes)
-            )
+        if check_signature:
+            found_matches.append(find_matches(channel_hashes, database))
 
-    # If checking signatures, align matches to see if the song is a duplicate
-    if check_signature == "Yes":
-        matched_song, confidence = align_matches(found_matches, database)
-        if matched_song:
-            logging.warning(
-                "Skipping '%s', determined to be a duplicate of '%s' (confidence: %d)",
-                audio["songname"],
-                matched_song[1],
-                confidence,
+            # Stop as soon as the channels so far prove the song is a duplicate
+            matched_song, confidence = align_matches(
+                np.concatenate(found_matches), database
             )
-            return
-
-    # Add new song and its fingerprints to the database
-    song_id = database.add_song(audio["songname"], audio["file_hash"], tag)
-    logging.info(
-        "id=%s: %s",
-        song_id,
-        colored(audio["songname"], "white", attrs=["bold"]),
-    )
+            if matched_song:
+                logging.warning(
+                    "Skipping '%s', determined to be a duplicate of '%s' (confidence: %d)",
+                    audio["songname"],
+                    matched_song[1],
+                    confidence,
+                )
+                return matched_song, False
+
+        for fingerprint_pair in channel_hashes:
+            all_channel_hashes_add(fingerprint_pair)
+
+    # Add new song and its fingerprints to the database in one transaction,
+    # so an interrupted run never leaves a song without all of its hashes;
+    # store_fingerprints joins it through a savepoint
+    with database.transaction("IMMEDIATE"):
+        song_id = database.add_song(audio["songname"], audio["file_hash"], tag)
+        song = database.get_song_by_id(song_id)
+        logging.info(
+            "id=%s: %s",
+            song_id,
+            colored(audio["songname"], "white", attrs=["bold"]),
+        )
 
-    fingerprint_values = [(song_id, h, o) for h, o in all_channel_hashes]
-    logging.info(
-        "Storing %d hashes for '%s'",
-        len(fingerprint_values),
-        audio["songname"],
-    )
-    database.store_fingerprints(fingerprint_values)
+        logging.info(
+            "Storing %d hashes for '%s'",
+            len(all_channel_hashes),
+            audio["songname"],
+        )
+        # Rows are built as each insert chunk is consumed, not as a second list
+        database.store_fingerprints((song_id, h, o) for h, o in all_channel_hashes)
+    song_index.add(song)
+    return song, True
 
 
 def main():
     """Main function to run the fingerprinting process."""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
     arguments = parse_arguments()
     config = get_config()
     mp3_directory = config.get("mp3_dir", "mp3/")
 
     with SqliteDatabase() as database:
-        for filename in os.listdir(mp3_directory):
-            if filename.endswith(".mp3"):
-                try:
-                    file_path = os.path.join(mp3_directory, filename)
-                    reader = FileReader(file_path)
-                    if audio_data := reader.parse_audio():
-                        fingerprint_song(
-                            audio_data, database, arguments.signature_check
-                        )
-                except (IOError, ValueError) as e:
-                    logging.error("Error processing %s: %s", filename, e)
+        song_index = SongIndex(database)
+        # Files processed before with the same mtime and size are not even
+        # decoded again, as long as their song is still in the library
+        new_files = list_new_files(
+            mp3_directory, database.get_scanned_files(), song_index.filehashes()
+        )
+        logging.info("Found %d new or changed files", len(new_files))
+        # Give the planner statistics for the fingerprint index once the new
+        # songs are in, so lookups keep using it as the library grows
+        if collect_files(new_files, database, song_index, arguments):
+            database.analyze()
 
     logging.info("--- End of fingerprinting process ---")
 
 
+def collect_files(new_files, database, song_index, arguments):
+    """
+    Fingerprints the given files and stores the new songs in the database.
+
+    Files are decoded and fingerprinted in parallel; the results are
+    written to the database one song at a time by this process, in the
+    order of new_files, so song IDs do not depend on which worker finishes
+    first. Only a few files per worker are fingerprinted ahead of the
+    writer, so memory stays bounded on a large first import.
+
+    Returns:
+        int: The number of songs added to the database.
+    """
+    added_songs = 0
+    window = FILES_IN_FLIGHT_PER_WORKER * arguments.workers
+    pending = deque()
+    with ProcessPoolExecutor(
+        max_workers=arguments.workers,
+        initializer=init_worker,
+        initargs=(song_index.filehashes(),),
+    ) as executor:
+        for file_info in new_files:
+            pending.append(
+                (executor.submit(compute_fingerprints, file_info[0]), file_info)
+            )
+            if len(pending) >= window:
+                added_songs += store_file(
+                    *pending.popleft(), database, song_index, arguments
+                )
+        while pending:
+            added_songs += store_file(
+                *pending.popleft(), database, song_index, arguments
+            )
+
+    return added_songs
+
+
+def store_file(future, file_info, database, song_index, arguments):
+    """
+    Waits for a file's fingerprints and stores its song in the database.
+
+    Returns:
+        bool: True if the song was added, False otherwise.
+    """
+    file_path, mtime, size = file_info
+    try:
+        if audio_data := future.result():
+            song, added = fingerprint_song(
+                audio_data, database, song_index, arguments.signature_check
+            )
+            database.mark_file_scanned(file_path, mtime, size, song["filehash"])
+            return added
+    except (IOError, ValueError) as e:
+        logging.error("Error processing %s: %s", os.path.basename(file_path), e)
+    return False
+
+
 if __name__ == "__main__":
     main()
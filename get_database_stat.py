@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Provides a command-line utility to display statistics about the audio database,
-including song counts, fingerprint counts, duplicates, and hash collisions.
+including song counts, fingerprint counts, and hash collisions.
 """
 
 from termcolor import colored
@@ -45,7 +45,7 @@ def print_songs(db_conn):
         SELECT
             s.id,
             s.name,
-            (SELECT count(f.id) FROM fingerprints AS f WHERE f.song_fk = s.id) AS fingerprints_count
+            (SELECT count(*) FROM fingerprints AS f WHERE f.song_fk = s.id) AS fingerprints_count
         FROM songs AS s
         ORDER BY fingerprints_count DESC
     """
@@ -58,37 +58,6 @@ def print_songs(db_conn):
         print(f"   ** {id_colored} {name_colored}: {hashes_colored}")
 
 
-def print_duplicates(db_conn):
-    """
-    Finds and prints songs that have duplicate fingerprints.
-
-    Args:
-        db_conn (SqliteDatabase): An active database connection object.
-    """
-    query = """
-        SELECT a.song_fk, s.name, SUM(a.cnt)
-        FROM (
-            SELECT song_fk, COUNT(*) cnt
-            FROM fingerprints
-            GROUP BY hash, song_fk, offset
-            HAVING cnt > 1
-            ORDER BY cnt ASC
-        ) a
-        JOIN songs s ON s.id = a.song_fk
-        GROUP BY a.song_fk
-    """
-    rows = db_conn.execute_all(query)
-
-    duplications_colored = colored(f"{len(rows)} song(s)", "yellow")
-    print(f" * duplications: {duplications_colored}")
-
-    for song_id, name, duplicate_count in rows:
-        id_colored = colored(f"id={song_id}", "white", attrs=["dark"])
-        name_colored = colored(name, "white", attrs=["bold"])
-        duplicates_colored = colored(f"{duplicate_count} duplicate(s)", "red")
-        print(f"   ** {id_colored} {name_colored}: {duplicates_colored}")
-
-
 def print_collisions(db_conn):
     """
     Finds and prints the total number of hash collisions.
@@ -125,10 +94,6 @@ if __name__ == "__main__":
         if song_count:
             print("")
 
-        print_duplicates(db)
-        if song_count:
-            print("")
-
         print_collisions(db)
 
         print("\ndone")
@@ -1,15 +1,10 @@
 """
-Initializes the libs package and configures the matplotlib backend.
+Initializes the libs package.
 
-This file sets the backend for matplotlib to 'TkAgg' to ensure compatibility
-across different environments.
+matplotlib is not imported here; plotting code loads it on demand through
+libs.utils.get_pyplot, which also picks a backend suited to the host.
 """
 
-import matplotlib
-
-# Set the backend for matplotlib
-matplotlib.use("TkAgg")
-
 
 def x():
     """A sample function for testing."""
@@ -3,19 +3,27 @@ This module handles loading and merging configuration files for the application.
 It reads settings from default and development JSON files and combines them.
 """
 
+import functools
 import json
 import os.path
 
 CONFIG_DEFAULT_FILE = "config.json"
 CONFIG_DEVELOPMENT_FILE = "config-development.json"
 
+# Files merged on top of the defaults, in increasing order of precedence
+CONFIG_FILES = (CONFIG_DEFAULT_FILE, CONFIG_DEVELOPMENT_FILE)
 
+
+@functools.lru_cache(maxsize=1)
 def get_config():
     """
     Loads configuration from multiple files and returns the merged result.
     It combines a hardcoded default, the contents of config.json,
     and the contents of config-development.json.
 
+    The files are only read on the first call; later calls return the
+    same cached dictionary, which callers must not modify.
+
     Returns:
         dict: A dictionary containing the merged configuration settings.
     """
@@ -23,8 +31,7 @@ def get_config():
 
     return merge_configs(
         default_config,
-        parse_config(CONFIG_DEFAULT_FILE),
-        parse_config(CONFIG_DEVELOPMENT_FILE),
+        *(parse_config(filename) for filename in CONFIG_FILES),
     )
 
 
@@ -35,6 +35,18 @@ class Database:
         """
         raise NotImplementedError
 
+    def get_songs_by_ids(self, song_ids):
+        """
+        Retrieves several songs by their IDs at once.
+
+        Args:
+            song_ids (iterable): The IDs of the songs to retrieve.
+
+        Returns:
+            dict: The songs found, keyed by ID.
+        """
+        raise NotImplementedError
+
     def get_song_by_tags(self, title, artist, album, genre, duration, track):
         """
         Retrieves a song by its metadata tags.
@@ -49,6 +61,15 @@ class Database:
         """
         raise NotImplementedError
 
+    def get_all_songs(self):
+        """
+        Retrieves every song in the database.
+
+        Returns:
+            list: The song records, in the same form as get_song_by_id.
+        """
+        raise NotImplementedError
+
     def add_song(self, filename, filehash, metadata):
         """
         Adds a new song to the database if it doesn't already exist.
@@ -72,6 +93,57 @@ class Database:
         """
         raise NotImplementedError
 
+    def has_fingerprints(self):
+        """
+        Checks whether any fingerprint has been stored yet.
+
+        Returns:
+            bool: True if the fingerprints table is not empty.
+        """
+        raise NotImplementedError
+
+    def get_match_counts(self, *channel_hashes):
+        """
+        Looks up fingerprint hashes and counts the matches per alignment.
+
+        Args:
+            *channel_hashes (iterable): (hash, offset) tuples of the sample to
+                                        match, one iterable per channel.
+
+        Returns:
+            list: (song_id, offset difference, match count) tuples.
+        """
+        raise NotImplementedError
+
+    def get_scanned_files(self):
+        """
+        Retrieves the files recorded as already processed.
+
+        Returns:
+            dict: Maps each file path to its (mtime, size, filehash) when
+                  processed.
+        """
+        raise NotImplementedError
+
+    def mark_file_scanned(self, path, mtime, size, filehash):
+        """
+        Records that a file has been processed, replacing any older record.
+
+        Args:
+            path (str): The path of the processed file.
+            mtime (float): The modification time of the file.
+            size (int): The size of the file in bytes.
+            filehash (str): The file hash of the library song the file was
+                            stored as or found to duplicate.
+        """
+        raise NotImplementedError
+
+    def analyze(self):
+        """
+        Updates the statistics the database uses to plan fingerprint lookups.
+        """
+        raise NotImplementedError
+
     def store_fingerprints(self, values):
         """
         Inserts multiple fingerprint records into the database.
@@ -3,12 +3,15 @@ This module provides a MongoDB implementation of the Database base class.
 It handles all direct interactions with a MongoDB server.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+
 from bson.objectid import ObjectId
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
 
 from .config import get_config
 from .db import Database
+from .utils import grouper
 
 
 class MongoDatabase(Database):
@@ -16,6 +19,14 @@ class MongoDatabase(Database):
     MongoDB database adapter for storing and retrieving song and fingerprint data.
     """
 
+    # Fingerprints are sent in unordered batches of this many documents, so
+    # no single request carries a whole song's BSON payload.
+    FINGERPRINT_CHUNK_SIZE = 500
+
+    # Batches sent at once; pymongo releases the GIL while waiting on the
+    # server, so threads overlap the round trips.
+    INSERT_WORKERS = 8
+
     def __init__(self):
         """
         Initializes the MongoDatabase object and establishes a connection.
@@ -97,7 +108,22 @@ class MongoDatabase(Database):
 
     def store_fingerprints(self, values):
         """Inserts multiple fingerprint records into the database."""
-        if documents := [
+        documents = (
             {"song_fk": song_id, "hash": h, "offset": o} for song_id, h, o in values
-        ]:
-            self.fingerprints.insert_many(documents)
+        )
+
+        def insert_chunk(chunk):
+            # Unordered, so the server does not stop at the first failed
+            # document and can apply the batch in any order
+            self.fingerprints.insert_many(
+                chunk, ordered=False, bypass_document_validation=True
+            )
+
+        chunks = grouper(documents, self.FINGERPRINT_CHUNK_SIZE)
+        with ThreadPoolExecutor(max_workers=self.INSERT_WORKERS) as executor:
+            # One batch per worker at a time, so only that many chunks of
+            # documents are ever built; consuming the results re-raises any
+            # error from a worker
+            for batches in grouper(chunks, self.INSERT_WORKERS):
+                for _ in executor.map(insert_chunk, batches):
+                    pass
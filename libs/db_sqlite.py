@@ -5,6 +5,9 @@ It handles all direct interactions with the SQLite database file.
 
 import logging
 import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+from itertools import chain
 
 from .config import get_config
 from .db import Database
@@ -23,6 +26,110 @@ class SqliteDatabase(Database):
 
     TABLE_SONGS = "songs"
     TABLE_FINGERPRINTS = "fingerprints"
+    TABLE_SCANNED_FILES = "scanned_files"
+
+    # Connection tuning for bulk fingerprint ingestion: WAL with NORMAL
+    # sync avoids an fsync per commit, and temp tables/page cache stay in RAM.
+    # Index lookups during matching read pages through a 1 GiB memory map
+    # instead of a read() call per page. page_size only takes effect on a
+    # new database and must be set before WAL is enabled.
+    PRAGMAS = (
+        "PRAGMA page_size=8192",
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-262144",
+        "PRAGMA mmap_size=1073741824",
+    )
+
+    # Seconds a connection waits for another writer's lock before failing
+    BUSY_TIMEOUT = 5.0
+
+    # Oldest SQLite library the statements run on: add_song uses
+    # INSERT ... RETURNING (3.35)
+    MIN_SQLITE_VERSION = (3, 35, 0)
+
+    # Tables of the schema; their indexes are listed in INDEXES
+    CREATE_TABLES = f"""
+        CREATE TABLE IF NOT EXISTS {TABLE_SONGS} (
+          id INTEGER PRIMARY KEY,
+          name TEXT,
+          filehash TEXT,
+          title TEXT,
+          artist TEXT,
+          album TEXT,
+          genre TEXT,
+          track INT,
+          duration INT
+        );
+        CREATE TABLE IF NOT EXISTS {TABLE_FINGERPRINTS} (
+          song_fk INTEGER NOT NULL,
+          hash INTEGER NOT NULL,
+          offset INTEGER NOT NULL,
+          PRIMARY KEY (hash, song_fk, offset)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS {TABLE_SCANNED_FILES} (
+          path TEXT PRIMARY KEY,
+          mtime REAL,
+          size INTEGER,
+          filehash TEXT
+        );
+    """
+
+    # Indexes every database needs, by table. The fingerprints table is
+    # clustered on its (hash, song_fk, offset) key, so the matching queries
+    # search the table itself. It has no index by song: one would hold a
+    # second copy of every row, for per-song counts that only the statistics
+    # script runs, so those scan the table instead.
+    INDEXES = (
+        (
+            TABLE_SONGS,
+            "CREATE UNIQUE INDEX IF NOT EXISTS songs_filehash_idx "
+            f"ON {TABLE_SONGS} (filehash)",
+        ),
+    )
+
+    # Statements on the lookup and ingest paths are built once, so every call
+    # passes the same string and hits sqlite3's prepared statement cache.
+    SELECT_SONG_BY_FILEHASH = f"SELECT * FROM {TABLE_SONGS} WHERE filehash = ?"
+    SELECT_SONG_ID_BY_FILEHASH = f"SELECT id FROM {TABLE_SONGS} WHERE filehash = ?"
+    INSERT_SONG = (
+        f"INSERT OR IGNORE INTO {TABLE_SONGS} "
+        "(name, filehash, title, artist, album, genre, track, duration) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) RETURNING id"
+    )
+    SELECT_SONG_BY_ID = f"SELECT * FROM {TABLE_SONGS} WHERE id = ?"
+    SELECT_ALL_SONGS = f"SELECT * FROM {TABLE_SONGS}"
+    SELECT_HASHES_COUNT = f"SELECT count(*) FROM {TABLE_FINGERPRINTS} WHERE song_fk = ?"
+    SELECT_ANY_FINGERPRINT = f"SELECT 1 FROM {TABLE_FINGERPRINTS} LIMIT 1"
+    # n is the number of channels that share a (hash, offset) query pair
+    CREATE_QUERY_HASHES = (
+        "CREATE TEMP TABLE IF NOT EXISTS query_hashes "
+        "(hash, offset INTEGER, n INTEGER, PRIMARY KEY (hash, offset))"
+    )
+    CLEAR_QUERY_HASHES = "DELETE FROM query_hashes"
+    INSERT_QUERY_HASH = "INSERT INTO query_hashes (hash, offset, n) VALUES (?, ?, ?)"
+    # CROSS JOIN pins query_hashes as the outer loop so every query hash
+    # becomes an index probe into fingerprints rather than a full scan.
+    SELECT_MATCH_COUNTS = (
+        "SELECT f.song_fk, f.offset - q.offset AS diff, SUM(q.n) "
+        "FROM query_hashes AS q "
+        f"CROSS JOIN {TABLE_FINGERPRINTS} AS f ON f.hash = q.hash "
+        "GROUP BY f.song_fk, diff"
+    )
+    INSERT_SCANNED_FILE = (
+        f"INSERT OR REPLACE INTO {TABLE_SCANNED_FILES} (path, mtime, size, filehash) "
+        "VALUES (?, ?, ?, ?)"
+    )
+    # Fingerprints are inserted this many rows per statement; 3 parameters
+    # per row stay well below SQLite's 32766 variable limit (3.32+).
+    FINGERPRINT_CHUNK_SIZE = 500
+    INSERT_FINGERPRINTS = (
+        f"INSERT OR IGNORE INTO {TABLE_FINGERPRINTS} (song_fk, hash, offset) VALUES "
+    )
+    INSERT_FINGERPRINTS_CHUNK = INSERT_FINGERPRINTS + ", ".join(
+        ["(?, ?, ?)"] * FINGERPRINT_CHUNK_SIZE
+    )
 
     def __init__(self, db_path=None):
         """
@@ -38,32 +145,139 @@ class SqliteDatabase(Database):
 
         self.conn = None
         self.cur = None
+        self.song_cur = None
+        # Number of 'with' blocks currently using the connection
+        self._depth = 0
 
     def __enter__(self):
-        """Opens the database connection when entering a 'with' block."""
-        self.conn = sqlite3.connect(self.db_path)
+        """
+        Opens the database connection when entering a 'with' block.
+
+        A nested block on the same object, such as a helper given an open
+        database, reuses the connection instead of opening and configuring
+        another one.
+        """
+        if self._depth:
+            self._depth += 1
+            return self
+
+        if sqlite3.sqlite_version_info < self.MIN_SQLITE_VERSION:
+            raise RuntimeError(
+                f"SQLite {sqlite3.sqlite_version} is too old, version "
+                f"{'.'.join(map(str, self.MIN_SQLITE_VERSION))} or later is required"
+            )
+
+        # Autocommit mode: sqlite3 never opens transactions implicitly, so
+        # writes that belong together use transaction() explicitly.
+        self.conn = sqlite3.connect(
+            self.db_path, timeout=self.BUSY_TIMEOUT, isolation_level=None
+        )
         self.conn.text_factory = str
         self.cur = self.conn.cursor()
+        # Song records can be read by column name as well as by position;
+        # fingerprint and match rows stay plain tuples, as they are many.
+        self.song_cur = self.conn.cursor()
+        self.song_cur.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            self.cur.execute(pragma)
+        self.create_indexes()
+        self._depth = 1
         log.info("sqlite - connection opened")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Commits changes and closes the connection when exiting a 'with' block."""
+        """Closes the connection when exiting the outermost 'with' block."""
+        self._depth -= 1
+        if self._depth:
+            return
         if self.conn:
+            # Only a transaction left open by a caller remains to be committed
             self.conn.commit()
+            # Refreshes planner statistics that this connection found stale
+            self.cur.execute("PRAGMA optimize")
             self.conn.close()
             log.info("sqlite - connection has been closed")
 
+    def create_schema(self):
+        """
+        Creates any missing table and index of the schema.
+
+        The whole schema is sent as one script, so it is parsed and run in a
+        single call. Like any script, it first commits an open transaction.
+        """
+        self.conn.executescript(
+            self.CREATE_TABLES + "".join(f"{index};\n" for _, index in self.INDEXES)
+        )
+
+    def create_indexes(self):
+        """
+        Creates any missing index on the tables that exist.
+
+        Databases built before an index was introduced get it on their next
+        connection, instead of scanning the fingerprints table on every
+        lookup until they are reset.
+        """
+        tables = {
+            name
+            for (name,) in self.execute_all(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+            )
+        }
+        for table, statement in self.INDEXES:
+            if table not in tables:
+                continue
+            try:
+                self.cur.execute(statement)
+            except sqlite3.IntegrityError as e:
+                # Only songs_filehash_idx is unique; a library that already
+                # holds the same file twice keeps working without it
+                log.warning("sqlite - could not create index: %s", e)
+
     # ----------------------------------------------------------------
     # Low-level cursor execution methods
     # ----------------------------------------------------------------
 
+    @contextmanager
+    def transaction(self, mode="DEFERRED"):
+        """
+        Runs the statements of a 'with' block in a single transaction.
+
+        The transaction is committed when the block finishes and rolled back
+        if it raises. Inside an already open transaction the block runs in a
+        savepoint instead: it becomes part of the outer transaction, and if
+        it raises only its own statements are undone.
+
+        Args:
+            mode (str): DEFERRED, IMMEDIATE or EXCLUSIVE. IMMEDIATE takes the
+                        write lock up front, which suits bulk inserts. It is
+                        ignored for nested blocks.
+        """
+        if self.conn.in_transaction:
+            # ROLLBACK TO and RELEASE act on the innermost savepoint of this
+            # name, so nested blocks can share it
+            self.cur.execute("SAVEPOINT nested")
+            try:
+                yield
+            except BaseException:
+                self.cur.execute("ROLLBACK TO nested")
+                self.cur.execute("RELEASE nested")
+                raise
+            self.cur.execute("RELEASE nested")
+            return
+
+        self.cur.execute(f"BEGIN {mode}")
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
     def query(self, query_string, values=None):
         """Executes a query that doesn't return a value (e.g., DROP, CREATE)."""
         if values is None:
             values = []
         self.cur.execute(query_string, values)
-        self.conn.commit()
 
     def execute_one(self, query, values=None):
         """Executes a query and returns the first result."""
@@ -86,7 +300,6 @@ class SqliteDatabase(Database):
         placeholders = ", ".join(["?"] * len(values))
         query = f"INSERT INTO {table} ({keys}) VALUES ({placeholders})"
         self.cur.execute(query, values)
-        self.conn.commit()
         return self.cur.lastrowid
 
     # ----------------------------------------------------------------
@@ -95,18 +308,35 @@ class SqliteDatabase(Database):
 
     def get_song_by_filehash(self, filehash):
         """Retrieves a song by its file hash."""
-        return self.execute_one(
-            f"SELECT * FROM {self.TABLE_SONGS} WHERE filehash = ?", [filehash]
-        )
+        return self.song_cur.execute(
+            self.SELECT_SONG_BY_FILEHASH, [filehash]
+        ).fetchone()
 
     def get_song_by_id(self, song_id):
         """Retrieves a song by its unique ID."""
-        return self.execute_one(
-            f"SELECT * FROM {self.TABLE_SONGS} WHERE id = ?", [song_id]
+        return self.song_cur.execute(self.SELECT_SONG_BY_ID, [song_id]).fetchone()
+
+    def get_songs_by_ids(self, song_ids):
+        """Retrieves several songs by their IDs in a single query."""
+        song_ids = list(song_ids)
+        if not song_ids:
+            return {}
+        placeholders = ", ".join(["?"] * len(song_ids))
+        rows = self.song_cur.execute(
+            f"SELECT * FROM {self.TABLE_SONGS} WHERE id IN ({placeholders})",
+            song_ids,
         )
+        return {row["id"]: row for row in rows}
 
-    def get_song_by_tags(self, title, artist, album, genre, duration, track):
-        """Retrieves a song by its metadata tags."""
+    @staticmethod
+    def _tag_conditions(title, artist, album, genre, duration, track):
+        """
+        Builds the WHERE conditions that match a song by its set tags.
+
+        Returns:
+            tuple: The conditions joined with AND (empty if no tag is set)
+                   and their parameter values.
+        """
         criteria = {}
         if title:
             criteria["title"] = title
@@ -121,24 +351,30 @@ class SqliteDatabase(Database):
         if track:
             criteria["track"] = track
 
-        if not criteria:
+        conditions = " AND ".join(f"{key} = ?" for key in criteria)
+        return conditions, list(criteria.values())
+
+    def get_song_by_tags(self, title, artist, album, genre, duration, track):
+        """Retrieves a song by its metadata tags."""
+        conditions, values = self._tag_conditions(
+            title, artist, album, genre, duration, track
+        )
+        if not conditions:
             return None
 
-        conditions = " AND ".join(f"{key} = ?" for key in criteria)
-        values = list(criteria.values())
         query = f"SELECT * FROM {self.TABLE_SONGS} WHERE {conditions}"
 
-        return self.execute_one(query, values)
+        return self.song_cur.execute(query, values).fetchone()
+
+    def get_all_songs(self):
+        """Retrieves every song in the database."""
+        return self.song_cur.execute(self.SELECT_ALL_SONGS).fetchall()
 
     def add_song(self, filename, filehash, metadata):
         """Adds a new song to the database if it doesn't already exist."""
-        # First, try to find the song by its unique hash
-        song = self.get_song_by_filehash(filehash)
-        if song:
-            return song[0]  # Return existing song ID
-
-        # If not found by hash, try to find it by metadata tags.
-        song = self.get_song_by_tags(
+        # Look the song up by its unique hash or its metadata tags in a single
+        # query; a hash match wins over a tag match, as it identifies the file.
+        conditions, values = self._tag_conditions(
             metadata.get("title"),
             metadata.get("artist"),
             metadata.get("album"),
@@ -146,40 +382,117 @@ class SqliteDatabase(Database):
             metadata.get("duration"),
             metadata.get("track"),
         )
+        if conditions:
+            song = self.execute_one(
+                f"SELECT id FROM {self.TABLE_SONGS} "
+                f"WHERE filehash = ? OR ({conditions}) "
+                "ORDER BY filehash = ? DESC LIMIT 1",
+                [filehash, *values, filehash],
+            )
+        else:
+            song = self.execute_one(self.SELECT_SONG_ID_BY_FILEHASH, [filehash])
         if song:
             return song[0]  # Return existing song ID
 
-        # If it's truly a new song, insert it
-        return self.insert(
-            self.TABLE_SONGS,
-            {
-                "name": filename,
-                "filehash": filehash,
-                "title": metadata.get("title"),
-                "artist": metadata.get("artist"),
-                "album": metadata.get("album"),
-                "genre": metadata.get("genre"),
-                "track": metadata.get("track"),
-                "duration": round(metadata.get("duration", 0), 1),
-            },
-        )
+        # If it's truly a new song, insert it. Should another connection have
+        # added the same file in the meantime, the unique filehash index makes
+        # the insert a no-op and the existing ID is returned instead.
+        song = self.execute_one(
+            self.INSERT_SONG,
+            [
+                filename,
+                filehash,
+                metadata.get("title"),
+                metadata.get("artist"),
+                metadata.get("album"),
+                metadata.get("genre"),
+                metadata.get("track"),
+                round(metadata.get("duration", 0), 1),
+            ],
+        ) or self.execute_one(self.SELECT_SONG_ID_BY_FILEHASH, [filehash])
+        return song[0]
 
     def get_song_hashes_count(self, song_id):
         """Gets the total number of fingerprints for a given song."""
-        query = f"SELECT count(*) FROM {self.TABLE_FINGERPRINTS} WHERE song_fk = ?"
-        rows = self.execute_one(query, [song_id])
+        rows = self.execute_one(self.SELECT_HASHES_COUNT, [song_id])
         return int(rows[0]) if rows else 0
 
+    def has_fingerprints(self):
+        """Checks whether any fingerprint has been stored yet."""
+        # Not cached: a rolled back insert can empty the table again, and the
+        # probe only reads the first page of the table
+        return self.execute_one(self.SELECT_ANY_FINGERPRINT) is not None
+
+    def _load_query_hashes(self, rows):
+        """Replaces the query_hashes temp table with (hash, offset, n) rows."""
+        self.cur.execute(self.CREATE_QUERY_HASHES)
+        with self.transaction():
+            self.cur.execute(self.CLEAR_QUERY_HASHES)
+            self.cur.executemany(self.INSERT_QUERY_HASH, rows)
+
+    def get_match_counts(self, *channel_hashes):
+        """
+        Looks up fingerprint hashes and counts the matches per alignment.
+
+        The hashes are loaded into a temporary table and joined against the
+        fingerprints table in a single query, so SQLite probes the hash index
+        once per hash instead of parsing large IN (...) lists. The offset
+        difference is computed by the join itself, from the query offset
+        stored next to each hash, and the matches are counted by SQLite, so
+        only one row per (song, offset difference) pair is returned to
+        Python. The hashes of several channels are looked up in one query;
+        a (hash, offset) pair found in more than one channel is stored once
+        and counted once per channel.
+
+        Returns:
+            list: (song_id, offset difference, match count) tuples.
+        """
+        query_pairs = Counter(
+            chain.from_iterable(dict(hashes).items() for hashes in channel_hashes)
+        )
+        self._load_query_hashes((h, o, n) for (h, o), n in query_pairs.items())
+
+        return self.execute_all(self.SELECT_MATCH_COUNTS)
+
+    def get_scanned_files(self):
+        """Retrieves the (mtime, size, filehash) of every file already processed."""
+        rows = self.execute_all(
+            f"SELECT path, mtime, size, filehash FROM {self.TABLE_SCANNED_FILES}"
+        )
+        return {path: (mtime, size, filehash) for path, mtime, size, filehash in rows}
+
+    def mark_file_scanned(self, path, mtime, size, filehash):
+        """Records that a file has been processed."""
+        self.query(self.INSERT_SCANNED_FILE, [path, mtime, size, filehash])
+
+    def analyze(self):
+        """Gathers query planner statistics after a bulk insert."""
+        # A bounded sample per index keeps this fast on large libraries
+        self.cur.execute("PRAGMA analysis_limit=1000")
+        self.query(f"ANALYZE {self.TABLE_FINGERPRINTS}")
+
     def store_fingerprints(self, values):
-        """Inserts multiple fingerprint records into the database."""
-        for split_values in grouper(values, 1000):
-            filtered_values = list(split_values)
-            if not filtered_values:
-                continue
+        """
+        Inserts multiple fingerprint records into the database.
 
-            query = (
-                f"INSERT OR IGNORE INTO {self.TABLE_FINGERPRINTS} "
-                "(song_fk, hash, offset) VALUES (?, ?, ?)"
-            )
-            self.cur.executemany(query, filtered_values)
-        self.conn.commit()
+        Args:
+            values (iterable): (song_id, hash, offset) tuples. They are
+                consumed one chunk at a time, so a generator is never
+                materialized in full.
+        """
+        chunk_size = self.FINGERPRINT_CHUNK_SIZE
+
+        # Take the write lock once and insert every row in a single transaction;
+        # each multi-row statement is parsed once and binds a whole chunk.
+        with self.transaction("IMMEDIATE"):
+            for chunk in grouper(values, chunk_size):
+                query = (
+                    self.INSERT_FINGERPRINTS_CHUNK
+                    if len(chunk) == chunk_size
+                    else self._insert_fingerprints_query(len(chunk))
+                )
+                self.cur.execute(query, list(chain.from_iterable(chunk)))
+
+    def _insert_fingerprints_query(self, rows):
+        """Builds an INSERT statement with VALUES placeholders for rows rows."""
+        return self.INSERT_FINGERPRINTS + ", ".join(["(?, ?, ?)"] * rows)
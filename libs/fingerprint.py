@@ -4,20 +4,19 @@ This module provides the core logic for generating audio fingerprints from raw
 audio samples. It transforms audio into a spectrogram, finds prominent peaks,
 and creates unique hashes based on pairs of these peaks.
 """
+import functools
 import hashlib
-from operator import itemgetter
+import struct
 
-import matplotlib.mlab as mlab
-import matplotlib.pyplot as plt
 import numpy as np
+import scipy.fft
 from scipy.ndimage.filters import maximum_filter
-from scipy.ndimage.morphology import (
-    binary_erosion,
-    generate_binary_structure,
-    iterate_structure,
-)
+from scipy.ndimage.morphology import binary_erosion, generate_binary_structure
+from numpy.lib.stride_tricks import sliding_window_view
 from termcolor import colored
 
+from .utils import get_pyplot
+
 IDX_FREQ_I = 0
 IDX_TIME_J = 1
 
@@ -47,6 +46,11 @@ DEFAULT_AMP_MIN = 10
 # fingerprints and faster matching, but can potentially affect accuracy.
 PEAK_NEIGHBORHOOD_SIZE = 20
 
+# The neighborhood is a diamond: the 3x3 cross below dilated by itself
+# PEAK_NEIGHBORHOOD_SIZE times. Filtering with the cross that many times
+# gives exactly the result of one pass with the whole 41x41 diamond.
+PEAK_CROSS = generate_binary_structure(2, 1)
+
 # Thresholds on how close or far fingerprints can be in time in order
 # to be paired as a fingerprint. If your max is too low, higher values of
 # DEFAULT_FAN_VALUE may not perform as expected.
@@ -58,14 +62,22 @@ MAX_HASH_TIME_DELTA = 200
 # affect performance.
 PEAK_SORT = True
 
-# Number of bits to throw away from the front of the SHA1 hash in the
-# fingerprint calculation. The more you throw away, the less storage, but
-# potentially higher collisions and misclassifications when identifying songs.
-FINGERPRINT_REDUCTION = 20
+# Size in bytes of the BLAKE2b digest used as the fingerprint hash.
+# Eight bytes fit a signed 64-bit SQLite INTEGER, which takes far less space
+# in the table and index than hex text and compares as a single integer.
+FINGERPRINT_BYTES = 8
+
+# Threads used by each batch of FFTs; -1 uses every CPU. Callers that already
+# run one process per CPU should lower this to 1.
+FFT_WORKERS = -1
+
+# Binary layout of the (freq1, freq2, t_delta) triple that is hashed
+HASH_INPUT = struct.Struct("<IIH")
 
 
 def _plot_channel_samples(channel_samples):
     """Helper function to plot audio samples."""
+    plt = get_pyplot()
     plt.plot(channel_samples)
     plt.title(f"{len(channel_samples)} samples")
     plt.xlabel("time (s)")
@@ -105,39 +117,95 @@ def fingerprint(
     # FFT the channel, log transform output, find local maxima, then return
     # locally sensitive hashes.
     # FFT the signal and extract frequency components
-    arr_2d = mlab.specgram(
-        channel_samples,
-        NFFT=wsize,
-        Fs=fs,
-        window=mlab.window_hanning,
-        noverlap=int(wsize * wratio),
-    )[0]
+    arr_2d = spectrogram(channel_samples, fs, wsize, int(wsize * wratio))
 
     # show spectrogram plot
     if plots:
+        plt = get_pyplot()
         plt.plot(arr_2d)
         plt.title("FFT")
         plt.show()
 
-    # apply log transform since specgram() returns linear array
-    # Set NumPy to ignore divide by zero warnings
-    np.seterr(divide="ignore", invalid="ignore")
-    arr_2d = 10 * np.log10(arr_2d)
-    arr_2d[arr_2d == -np.inf] = 0  # replace infs with zeros
-    np.seterr(divide="warn", invalid="warn")
+    # apply log transform since specgram() returns linear array; it is done
+    # in place, as the spectrogram is the largest array in this function
+    with np.errstate(divide="ignore", invalid="ignore"):
+        np.log10(arr_2d, out=arr_2d)
+    arr_2d *= 10
+    arr_2d[np.isneginf(arr_2d)] = 0  # replace infs with zeros
 
     # find local maxima
     local_maxima = get_2d_peaks(arr_2d, plot=plots, amp_min=amp_min)
 
     msg = "   local_maxima: %d of frequency & time pairs"
-    local_maxima_to_list = list(local_maxima)
-    print(colored(msg, attrs=["dark"]) % len(local_maxima_to_list))
+    print(colored(msg, attrs=["dark"]) % len(local_maxima))
+
+    return generate_hashes(local_maxima, fan_value=fan_value)
+
+
+@functools.lru_cache(maxsize=4)
+def _hanning_window(wsize):
+    """Returns the float32 Hanning window of the given size, computed once."""
+    return np.hanning(wsize).astype(np.float32)
+
+
+def spectrogram(channel_samples, fs, wsize, noverlap):
+    """
+    Computes the power spectral density of overlapping windows of a channel.
+
+    The result matches matplotlib.mlab.specgram with a Hanning window and its
+    defaults: one-sided spectrum, scaled by the sampling frequency and the
+    window energy. Real FFTs are used, computing only the non-negative
+    frequencies, over all windows at once.
+
+    Args:
+        channel_samples (np.array): Audio data for a single channel.
+        fs (int): Sample rate of the audio.
+        wsize (int): FFT window size.
+        noverlap (int): Number of samples shared by consecutive windows.
+
+    Returns:
+        np.array: A (wsize // 2 + 1, windows) float32 array of frequency by
+                  time.
+    """
+    samples = np.asarray(channel_samples)
+    if len(samples) < wsize:
+        samples = np.pad(samples, (0, wsize - len(samples)))
+
+    window = _hanning_window(wsize)
+    frames = sliding_window_view(samples, wsize)[:: wsize - noverlap]
+    # float32 halves the memory traffic of every pass over the spectrogram
+    windowed = np.multiply(frames, window, dtype=np.float32)
+    spectrum = scipy.fft.rfft(windowed, axis=1, workers=FFT_WORKERS)
+    power = spectrum.real**2 + spectrum.imag**2
+
+    # Double every frequency but DC (and Nyquist for even sizes) to fold in
+    # the negative half, then normalize to a density
+    power[:, 1 : -1 if wsize % 2 == 0 else None] *= 2
+    power /= fs
+    power /= (window**2).sum()
+    return power.T
+
+
+def fingerprint_channel(channel_samples, fs=DEFAULT_FS):
+    """
+    Fingerprints a single channel and returns all of its hashes at once.
+
+    Unlike fingerprint(), the result is a list, so channels can be
+    fingerprinted in worker processes and the hashes sent back.
 
-    return generate_hashes(local_maxima_to_list, fan_value=fan_value)
+    Args:
+        channel_samples (np.array): Audio data for a single channel.
+        fs (int): Sample rate of the audio.
+
+    Returns:
+        list: A list of (hash, offset) tuples.
+    """
+    return list(fingerprint(channel_samples, fs=fs))
 
 
 def _plot_spectrogram_peaks(arr_2d, time_idx, frequency_idx):
     """Helper function to plot spectrogram and peaks."""
+    plt = get_pyplot()
     _, ax = plt.subplots()
     ax.imshow(arr_2d)
     ax.scatter(time_idx, frequency_idx)
@@ -158,76 +226,93 @@ def get_2d_peaks(arr_2d, plot=False, amp_min=DEFAULT_AMP_MIN):
         amp_min (int): Minimum amplitude for a peak to be considered.
 
     Returns:
-        list: A list of (frequency_index, time_index) tuples for peaks.
+        np.array: An (N, 2) array with a (frequency_index, time_index) row
+                  per peak.
     """
-    # http://docs.scipy.org/doc/scipy/reference/generated/scipy.ndimage.morphology.iterate_structure.html#scipy.ndimage.morphology.iterate_structure
-    struct = generate_binary_structure(2, 1)
-    neighborhood = iterate_structure(struct, PEAK_NEIGHBORHOOD_SIZE)
-
-    # find local maxima using our fliter shape
-    local_max = maximum_filter(arr_2d, footprint=neighborhood) == arr_2d
+    # find local maxima using our fliter shape; 20 passes over 5 cells cost
+    # far less than one pass over the 841 cells of the diamond
+    neighborhood_max = arr_2d
+    for _ in range(PEAK_NEIGHBORHOOD_SIZE):
+        neighborhood_max = maximum_filter(neighborhood_max, footprint=PEAK_CROSS)
+    local_max = neighborhood_max == arr_2d
     background = arr_2d == 0
     eroded_background = binary_erosion(
-        background, structure=neighborhood, border_value=1
+        background,
+        structure=PEAK_CROSS,
+        iterations=PEAK_NEIGHBORHOOD_SIZE,
+        border_value=1,
     )
 
-    # Boolean mask of arr_2d with True at peaks
+    # Boolean mask of arr_2d with True at peaks loud enough to keep; the
+    # amplitude filter is applied to the whole mask before any index is taken
     detected_peaks = local_max ^ eroded_background
+    detected_peaks &= arr_2d > amp_min
 
-    # extract peaks
-    amps = arr_2d[detected_peaks]
-    j, i = np.nonzero(detected_peaks)
-
-    # filter peaks
-    amps = amps.flatten()
-    peaks = zip(i, j, amps)
-    peaks_filtered = [x for x in peaks if x[2] > amp_min]  # freq, time, amp
-
-    # get indices for frequency and time
-    frequency_idx = [x[1] for x in peaks_filtered]
-    time_idx = [x[0] for x in peaks_filtered]
+    # extract peaks, one (frequency, time) row each in row-major order
+    peaks = np.argwhere(detected_peaks)
 
     # scatter of the peaks
     if plot:
-        _plot_spectrogram_peaks(arr_2d, time_idx, frequency_idx)
+        _plot_spectrogram_peaks(arr_2d, peaks[:, IDX_TIME_J], peaks[:, IDX_FREQ_I])
 
-    return zip(frequency_idx, time_idx)
+    return peaks
 
 
-# Hash list structure: sha1_hash[0:20] time_offset
-# example: [(e05b341a9b77a51fd26, 32), ... ]
+# Hash list structure: signed int64 of blake2b(freq1, freq2, t_delta), time_offset
+# example: [(-2280546231581616649, 32), ... ]
 def generate_hashes(peaks, fan_value=DEFAULT_FAN_VALUE):
     """
     Generates hashes from a list of peaks.
 
     Args:
-        peaks (list): A list of (frequency_index, time_index) tuples.
+        peaks (np.array): (frequency_index, time_index) pairs, one per row.
         fan_value (int): Degree to which a fingerprint can be paired with neighbors.
 
     Yields:
-        tuple: (hash, time_offset) tuples.
+        tuple: (hash, time_offset) tuples, each one at most once per call.
     """
+    peaks = np.asarray(peaks, dtype=np.int64).reshape(-1, 2)
     if PEAK_SORT:
-        peaks.sort(key=itemgetter(1))
-
-    # bruteforce all peaks
-    for i in range(len(peaks)):  # pylint: disable=consider-using-enumerate
-        for j in range(1, fan_value):
-            if (i + j) < len(peaks):
-                # take current & next peak frequency value
-                freq1 = peaks[i][IDX_FREQ_I]
-                freq2 = peaks[i + j][IDX_FREQ_I]
-
-                # take current & next -peak time offset
-                t1 = peaks[i][IDX_TIME_J]
-                t2 = peaks[i + j][IDX_TIME_J]
-
-                # get diff of time offsets
-                t_delta = t2 - t1
-
-                # check if delta is between min & max
-                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
-                    hash_input = f"{freq1}|{freq2}|{t_delta}".encode("utf-8")
-                    h = hashlib.sha1(hash_input)
-
-                    yield (h.hexdigest()[:FINGERPRINT_REDUCTION], t1)
+        peaks = peaks[np.argsort(peaks[:, IDX_TIME_J], kind="stable")]
+    freqs = peaks[:, IDX_FREQ_I]
+    times = peaks[:, IDX_TIME_J]
+
+    # Pair every peak i with the peak j places after it, for all j at once,
+    # and keep only the pairs whose time delta is within bounds
+    anchors = []
+    distances = []
+    for j in range(1, fan_value):
+        t_delta = times[j:] - times[:-j]
+        (i,) = np.nonzero(
+            (t_delta >= MIN_HASH_TIME_DELTA) & (t_delta <= MAX_HASH_TIME_DELTA)
+        )
+        anchors.append(i)
+        distances.append(np.full(len(i), j))
+    anchors = np.concatenate(anchors)
+    distances = np.concatenate(distances)
+
+    # Restore the peak-by-peak order of the pairs
+    order = np.lexsort((distances, anchors))
+    anchors = anchors[order]
+    partners = anchors + distances[order]
+
+    # Peak pairs frequently repeat within a channel; drop the duplicates here
+    # so callers never have to hold a second copy just to deduplicate.
+    seen = set()
+    seen_add = seen.add
+    blake2b = hashlib.blake2b
+    pack = HASH_INPUT.pack
+    # Plain ints so SQLite stores INTEGERs, not numpy bytes
+    for freq1, freq2, t1, t2 in zip(
+        freqs[anchors].tolist(),
+        freqs[partners].tolist(),
+        times[anchors].tolist(),
+        times[partners].tolist(),
+    ):
+        digest = blake2b(
+            pack(freq1, freq2, t2 - t1), digest_size=FINGERPRINT_BYTES
+        ).digest()
+        fingerprint_pair = (int.from_bytes(digest, "big", signed=True), t1)
+        if fingerprint_pair not in seen:
+            seen_add(fingerprint_pair)
+            yield fingerprint_pair
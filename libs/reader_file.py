@@ -4,7 +4,13 @@ This module provides a file reader for audio files, capable of parsing audio
 data, metadata tags, and generating a unique file hash.
 """
 import os
-from hashlib import sha1
+from functools import partial
+from hashlib import blake2b
+
+try:
+    from hashlib import file_digest
+except ImportError:  # Python < 3.11
+    file_digest = None
 
 import numpy as np
 from pydub import AudioSegment
@@ -13,6 +19,10 @@ from tinytag import TinyTag
 
 from .reader import BaseReader
 
+# BLAKE2b is faster than SHA1 in software; 20 bytes keep the 40 hex digit
+# width of the SHA1 file hashes used before.
+_file_hasher = partial(blake2b, digest_size=20)
+
 
 class FileReader(BaseReader):
     """
@@ -28,6 +38,7 @@ class FileReader(BaseReader):
         """
         super().__init__()
         self.filename = filename
+        self._file_hash = None
 
     def recognize(self):
         """
@@ -49,23 +60,30 @@ class FileReader(BaseReader):
 
         Returns:
             dict: A dictionary containing song properties and audio data, or an
-                  empty dictionary if the file is unreadable.
+                  empty dictionary if the file is unreadable. "channels" is a
+                  (channels, samples) int16 array.
         """
         songname, extension = os.path.splitext(os.path.basename(self.filename))
 
+        # The hash is cached on the reader, so a caller that checked it before
+        # decoding does not make this read the file a second time
+        file_hash = self.parse_file_hash()
+
         try:
             audiofile = AudioSegment.from_file(self.filename)
 
             if limit:
                 audiofile = audiofile[: limit * 1000]
 
-            # Use the public API to get audio data as a numpy array
-            data = np.array(audiofile.get_array_of_samples(), dtype=np.int16)
+            # Use the public API to get audio data as a numpy array; 16-bit
+            # samples are viewed in place rather than copied element by element
+            data = np.asarray(audiofile.get_array_of_samples()).astype(
+                np.int16, copy=False
+            )
 
-            # Use a list comprehension to extract channels
-            channels = [
-                data[chn :: audiofile.channels] for chn in range(audiofile.channels)
-            ]
+            # Deinterleave with one reshape and transposed copy into a
+            # (channels, samples) array, so each channel row is contiguous
+            channels = np.ascontiguousarray(data.reshape(-1, audiofile.channels).T)
 
         except audioop.error:
             # pydub does not support 24-bit wav files, which can cause this error.
@@ -79,7 +97,7 @@ class FileReader(BaseReader):
             "extension": extension,
             "channels": channels,
             "Fs": audiofile.frame_rate,
-            "file_hash": self.parse_file_hash(),
+            "file_hash": file_hash,
             "metadata": self.get_song_tags(),
         }
 
@@ -89,22 +107,32 @@ class FileReader(BaseReader):
         Inspired by MD5 version here:
         http://stackoverflow.com/a/1131255/712997
 
-        Works with large files.
+        Works with large files. The result is remembered, so the file is
+        only read once per FileReader.
 
         Args:
-            blocksize (int): The size of each chunk to read from the file.
+            blocksize (int): The size of each chunk to read from the file when
+                             hashlib.file_digest is not available.
 
         Returns:
             str: The uppercase hexadecimal hash of the file.
         """
-        s = sha1()
-        with open(self.filename, "rb") as f:
-            while True:
-                if buf := f.read(blocksize):
-                    s.update(buf)
+        if self._file_hash is None:
+            # Unbuffered, since both paths read straight into their own buffer
+            with open(self.filename, "rb", buffering=0) as f:
+                if file_digest:
+                    # Hashes straight from the file descriptor in C
+                    s = file_digest(f, _file_hasher)
                 else:
-                    break
-        return s.hexdigest().upper()
+                    # Read into one reusable buffer instead of a new bytes
+                    # object per block
+                    s = _file_hasher()
+                    buf = bytearray(blocksize)
+                    view = memoryview(buf)
+                    while size := f.readinto(buf):
+                        s.update(view[:size])
+            self._file_hash = s.hexdigest().upper()
+        return self._file_hash
 
     def get_song_tags(self):
         """
@@ -19,12 +19,16 @@ class MicrophoneReader(BaseReader):
     default_channels = 2
     default_rate = 44100
 
+    # Seconds of audio the recording buffer holds before it has to grow
+    initial_buffer_seconds = 60
+
     def __init__(self):
         """Initializes the MicrophoneReader and PyAudio instance."""
         super().__init__()
         self.audio = pyaudio.PyAudio()
         self.stream = None
-        self.data = []
+        self.data = numpy.empty((self.default_channels, 0), numpy.int16)
+        self.length = 0
         self.channels = self.default_channels
         self.chunksize = self.default_chunksize
         self.rate = self.default_rate
@@ -67,7 +71,11 @@ class MicrophoneReader(BaseReader):
             frames_per_buffer=chunksize,
         )
 
-        self.data = [[] for _ in range(channels)]
+        # One row per channel, filled up to self.length
+        self.data = numpy.empty(
+            (channels, rate * self.initial_buffer_seconds), numpy.int16
+        )
+        self.length = 0
 
     def process_recording(self):
         """
@@ -83,8 +91,19 @@ class MicrophoneReader(BaseReader):
         # Note: numpy.fromstring is deprecated, using numpy.frombuffer instead.
         nums = numpy.frombuffer(data, numpy.int16)
 
-        for c in range(self.channels):
-            self.data[c].extend(nums[c :: self.channels])
+        frames = len(nums) // self.channels
+        end = self.length + frames
+        if end > self.data.shape[1]:
+            # Double the capacity, so long recordings only rarely copy
+            grown = numpy.empty(
+                (self.channels, max(2 * self.data.shape[1], end)), numpy.int16
+            )
+            grown[:, : self.length] = self.data[:, : self.length]
+            self.data = grown
+
+        # Deinterleave the chunk straight into the per-channel rows
+        self.data[:, self.length : end] = nums.reshape(-1, self.channels).T
+        self.length = end
 
         return nums
 
@@ -103,10 +122,10 @@ class MicrophoneReader(BaseReader):
         Returns the recorded audio data.
 
         Returns:
-            list: A list of lists, where each sublist contains the sample
-                  data for a single channel.
+            numpy.array: A 2-D array view with one row of sample data per
+                         channel.
         """
-        return self.data
+        return self.data[:, : self.length]
 
     def save_recorded(self, output_filename):
         """
@@ -121,9 +140,9 @@ class MicrophoneReader(BaseReader):
         wf.setframerate(self.rate)
 
         # Interleave channel data before writing
-        # Stack channels vertically (e.g., [[c1, c1], [c2, c2]])
-        # then transpose to interleave them ([[c1, c2], [c1, c2]])
-        interleaved_data = numpy.vstack(self.data).T
+        # Channels are stored as rows (e.g., [[c1, c1], [c2, c2]]);
+        # transpose to interleave them ([[c1, c2], [c1, c2]])
+        interleaved_data = self.get_recorded_data().T
 
         wf.writeframes(interleaved_data.tobytes())
         wf.close()
@@ -138,4 +157,4 @@ class MicrophoneReader(BaseReader):
         Returns:
             float: The length of the recording in seconds.
         """
-        return len(self.data[0]) / self.rate
+        return self.length / self.rate
@@ -0,0 +1,88 @@
+"""
+This module matches the fingerprints of a recording against the database
+and ranks the songs they align with. It is shared by the file and
+microphone recognition scripts.
+"""
+
+import numpy as np
+from termcolor import colored
+
+import libs.fingerprint as fingerprint
+
+# Number of candidate songs reported for a recording
+CANDIDATES = 3
+
+
+def return_matches(channel_hashes, db):
+    """
+    Returns matches from the database for the hashes of every channel.
+
+    All channels are looked up in a single query, so a hash found in more
+    than one channel is only probed once. The matches are counted per
+    (song, offset difference) pair by the database, so only one row per
+    pair is held in memory.
+
+    Args:
+        channel_hashes (list): A list of (hash, offset) tuples per channel.
+        db (SqliteDatabase): An active database connection.
+
+    Returns:
+        np.ndarray: An (N, 3) int64 array of (song_id, offset difference,
+                    match count) rows.
+    """
+    matches = np.array(
+        db.get_match_counts(*channel_hashes), dtype=np.int64
+    ).reshape(-1, 3)
+
+    if len(matches):
+        print(colored(f"   ** found {matches[:, 2].sum()} hash matches", "green"))
+    else:
+        print(colored("   ** no matches found", "red"))
+
+    return matches
+
+
+def align_matches(matches, db, limit=CANDIDATES):
+    """
+    Aligns matches to find the best matching songs and their offsets.
+
+    Args:
+        matches (np.ndarray): (song_id, offset difference, match count) rows.
+        db (SqliteDatabase): An active database connection.
+        limit (int): The maximum number of candidate songs to return.
+
+    Returns:
+        list: Dictionaries with each candidate song's information at its best
+              alignment, best match first. A song whose record is missing,
+              such as one deleted without its fingerprints, is named
+              "Unknown".
+    """
+    # Each row is a distinct (song_id, diff) pair; order them by count, with
+    # ties going towards the lowest pair, and keep the best row of each song
+    matches = matches[np.lexsort((matches[:, 1], matches[:, 0], -matches[:, 2]))]
+    _, best_rows = np.unique(matches[:, 0], return_index=True)
+    top = matches[np.sort(best_rows)[:limit]].tolist()
+
+    # One query for the names of every candidate
+    songs = db.get_songs_by_ids(song_id for song_id, _, _ in top)
+
+    candidates = []
+    for song_id, largest_offset, largest_count in top:
+        song = songs.get(song_id)
+        n_seconds = round(
+            float(largest_offset)
+            / fingerprint.DEFAULT_FS
+            * fingerprint.DEFAULT_WINDOW_SIZE
+            * fingerprint.DEFAULT_OVERLAP_RATIO,
+            5,
+        )
+        candidates.append(
+            {
+                "SONG_ID": song_id,
+                "SONG_NAME": song[1] if song else "Unknown",
+                "CONFIDENCE": largest_count,
+                "OFFSET": int(largest_offset),
+                "OFFSET_SECS": n_seconds,
+            }
+        )
+    return candidates
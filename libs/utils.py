@@ -3,12 +3,42 @@ This module provides common utility functions used across the project,
 such as the 'grouper' for iterating over a list in fixed-size chunks.
 """
 
-from itertools import zip_longest
+import functools
+import os
+import sys
+from itertools import islice
 
 
-def grouper(iterable, n, fillvalue=None):
-    """Groups elements from an iterable into fixed-length chunks."""
-    iterators = [iter(iterable)] * n
-    return (
-        filter(None, values) for values in zip_longest(fillvalue=fillvalue, *iterators)
-    )
+def grouper(iterable, n):
+    """
+    Groups elements from an iterable into chunks of at most n elements.
+
+    Unlike the zip_longest recipe, the last chunk is not padded and falsy
+    elements (such as an offset of 0) are kept.
+    """
+    iterator = iter(iterable)
+    while chunk := tuple(islice(iterator, n)):
+        yield chunk
+
+
+@functools.lru_cache(maxsize=1)
+def get_pyplot():
+    """
+    Imports matplotlib.pyplot on first use.
+
+    The interactive TkAgg backend is selected when a display is available and
+    the non-interactive Agg backend otherwise, so headless machines never load
+    Tk. Scripts that do not plot never import matplotlib.pyplot at all.
+
+    Returns:
+        module: The matplotlib.pyplot module.
+    """
+    # pylint: disable=import-outside-toplevel
+    import matplotlib
+
+    has_display = sys.platform in ("win32", "darwin") or "DISPLAY" in os.environ
+    matplotlib.use("TkAgg" if has_display else "Agg")
+
+    import matplotlib.pyplot as plt
+
+    return plt
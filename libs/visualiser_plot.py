@@ -2,7 +2,7 @@
 Provides a plot-based audio visualizer using Matplotlib.
 """
 
-from matplotlib import pyplot
+from .utils import get_pyplot
 
 
 class VisualiserPlot:
@@ -18,5 +18,6 @@ class VisualiserPlot:
         Args:
             data (np.array): A numpy array of audio samples.
         """
+        pyplot = get_pyplot()
         pyplot.plot(data)
         pyplot.show()
@@ -1,144 +1,161 @@
 """
 Audio recognition script for matching audio samples to songs using fingerprints.
 
-This module provides functions to group iterables, fingerprint audio samples,
-find matches in a database, and align matches to identify the best matching song.
+This module provides functions to fingerprint audio samples, find matches
+in a database, and align matches to identify the best matching song.
 It can be run as a standalone script to recognize songs from an audio file.
 """
 
 #!/usr/bin/python
+import os
+import re
 import sys
 import argparse
 from argparse import RawTextHelpFormatter
-from itertools import zip_longest
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
+import numpy as np
 from termcolor import colored
 
 from libs.config import get_config
 from libs.db_sqlite import SqliteDatabase
 from libs.reader_file import FileReader
+from libs.recognizer import align_matches, return_matches
 import libs.fingerprint as fingerprint
 
+# Part of every fingerprint cache file name; bump it whenever a change to
+# the fingerprinting, or to the entry format, makes cached entries invalid.
+CACHE_VERSION = 2
 
-def grouper(iterable, n, fillvalue=None):
-    """Groups elements from iterable in chunks of size n."""
-    iterators = [iter(iterable)] * n
-    return (
-        filter(None, values) for values in zip_longest(fillvalue=fillvalue, *iterators)
-    )
+# Size the fingerprint cache is trimmed to when "fingerprint.cache_max_mb"
+# is not configured; the least recently used entries are removed first
+CACHE_MAX_MB = 256
+
+# Names of the cache entries, of this and older versions
+CACHE_ENTRY = re.compile(r"[0-9A-Fa-f]+-v\d+\.(npy|pkl)")
 
 
-def find_matches(samples, fs, db):
+def get_cache_file(file_hash, config):
     """
-    Finds fingerprint matches for the given audio samples.
+    Returns the path of the fingerprint cache entry for a file.
 
     Args:
-        samples (array-like): Audio samples to fingerprint.
-        fs (int): Sample rate of the audio.
-        db (SqliteDatabase): Database instance.
+        file_hash (str): The content hash of the audio file.
+        config (dict): The application configuration.
 
     Returns:
-        generator: Yields tuples of (song_id, offset difference) for matches found in the database.
+        str: The cache file path, or None if caching is disabled.
     """
-    hashes = fingerprint.fingerprint(samples, fs=fs)
-    return return_matches(hashes, db)
+    cache_dir = config.get("fingerprint.cache_dir")
+    if not cache_dir:
+        return None
+    return os.path.join(
+        os.path.expanduser(cache_dir), f"{file_hash}-v{CACHE_VERSION}.npy"
+    )
 
 
-def return_matches(hashes, db):
+def load_cached_hashes(cache_file):
     """
-    Returns matches from the database for the given hashes.
+    Loads the fingerprints of every channel of a file from the cache.
+
+    A hit marks the entry as recently used, so it is the last to be evicted.
 
     Args:
-        hashes (list): List of (hash, offset) tuples.
-        db (SqliteDatabase): Database instance.
+        cache_file (str): The cache file path, or None.
 
-    Yields:
-        tuple: (song_id, offset difference)
+    Returns:
+        list: A list of (hash, offset) tuples per channel, or None on a miss.
+              An unreadable entry, or one that is not an (N, 3) int64 array,
+              counts as a miss.
     """
-    mapper = {str(hash_val).upper(): int(offset) for hash_val, offset in hashes}
-    values = mapper.keys()
-
-    for split_values in grouper(values, 1000):
-        split_values = list(split_values)  # Convert filter object to list
-        query = (
-            "SELECT upper(hash), song_fk, offset "
-            "FROM fingerprints "
-            "WHERE upper(hash) IN (%s)"
-        )
-        query %= ", ".join("?" * len(split_values))
-
-        x = db.execute_all(query, split_values)
-        matches_found = len(x)
-
-        if matches_found > 0:
-            local_msg = "   ** found %d hash matches (step %d/%d)"
-            print(
-                colored(local_msg, "green")
-                % (matches_found, len(split_values), len(values))
-            )
-        else:
-            local_msg = "   ** no matches found (step %d/%d)"
-            print(colored(local_msg, "red") % (len(split_values), len(values)))
-
-        for hash_val, sid, db_offset in x:
-            # Decode db_offset if it's a byte string, then convert to int
-            if isinstance(db_offset, bytes):
-                db_offset = int.from_bytes(db_offset, byteorder="little")
-            else:
-                db_offset = int(db_offset)
-
-            yield (sid, db_offset - mapper[str(hash_val)])
+    if not cache_file:
+        return None
+    try:
+        rows = np.load(cache_file, allow_pickle=False)
+    except (OSError, EOFError, ValueError):
+        return None
+    if not (
+        isinstance(rows, np.ndarray)
+        and rows.dtype == np.int64
+        and rows.ndim == 2
+        and rows.shape[1] == 3
+    ):
+        return None
+
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+
+    channel_hashes = []
+    for channel in range(rows[:, 0].max() + 1 if len(rows) else 0):
+        _, hashes, offsets = rows[rows[:, 0] == channel].T
+        channel_hashes.append(list(zip(hashes.tolist(), offsets.tolist())))
+    return channel_hashes
+
+
+def save_cached_hashes(cache_file, channel_hashes, max_bytes):
+    """
+    Stores the fingerprints of every channel of a file in the cache.
 
+    The entry is a plain (channel, hash, offset) int64 array; channels
+    without any hash match nothing and are not kept. The cache is then
+    trimmed to max_bytes.
 
-def align_matches(match_tuples, db):
+    Args:
+        cache_file (str): The cache file path, or None.
+        channel_hashes (list): A list of (hash, offset) tuples per channel.
+        max_bytes (int): The size the cache directory is trimmed to.
     """
-    Aligns matches to find the best matching song and offset.
+    if not cache_file:
+        return
+    rows = np.array(
+        [
+            (channel, h, o)
+            for channel, hashes in enumerate(channel_hashes)
+            for h, o in hashes
+        ],
+        dtype=np.int64,
+    ).reshape(-1, 3)
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # Written under a temporary name first, so a concurrent run never
+        # loads a half written entry
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            np.save(f, rows, allow_pickle=False)
+        os.replace(tmp_file, cache_file)
+        evict_cached_hashes(os.path.dirname(cache_file), max_bytes)
+    except OSError as e:
+        print(colored(f" * could not cache fingerprints: {e}", "yellow"))
+
+
+def evict_cached_hashes(cache_dir, max_bytes):
+    """
+    Removes the least recently used cache entries beyond max_bytes.
 
     Args:
-        match_tuples (iterable): Iterable of (song_id, offset difference) tuples.
-        db (SqliteDatabase): Database instance.
-
-    Returns:
-        dict: Information about the best matching song.
+        cache_dir (str): The cache directory.
+        max_bytes (int): The total size of the entries to keep at most.
     """
-    diff_counter = {}
-    largest = 0
-    largest_count = 0
-    song_id = -1
-
-    for tup in match_tuples:
-        sid, diff = tup
-
-        if diff not in diff_counter:
-            diff_counter[diff] = {}
-
-        if sid not in diff_counter[diff]:
-            diff_counter[diff][sid] = 0
-
-        diff_counter[diff][sid] += 1
-
-        if diff_counter[diff][sid] > largest_count:
-            largest = diff
-            largest_count = diff_counter[diff][sid]
-            song_id = sid
-
-    song_m = db.get_song_by_id(song_id)
-
-    n_seconds = round(
-        float(largest)
-        / fingerprint.DEFAULT_FS
-        * fingerprint.DEFAULT_WINDOW_SIZE
-        * fingerprint.DEFAULT_OVERLAP_RATIO,
-        5,
-    )
-
-    return {
-        "SONG_ID": song_id,
-        "SONG_NAME": song_m[1],
-        "CONFIDENCE": largest_count,
-        "OFFSET": int(largest),
-        "OFFSET_SECS": n_seconds,
-    }
+    entries = []
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if CACHE_ENTRY.fullmatch(entry.name) and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already evicted by a concurrent run
+            pass
+        total -= size
 
 
 if __name__ == "__main__":
@@ -158,34 +175,45 @@ if __name__ == "__main__":
     with SqliteDatabase() as DB:
         # All database-dependent code must be indented inside this block
         reader = FileReader(FILE_PATH)
-        audio_data = reader.parse_audio()
-
-        CHANNELS = audio_data["channels"]
-        FS = audio_data["Fs"]
-        MSG = f" * loaded {len(CHANNELS[0])} samples from file '{FILE_PATH}'"
-        print(colored(MSG, attrs=["dark"]))
-
-        # This loop must be inside the 'with' block to use the open connection
-        matches = []
-        for channeln, channel in enumerate(CHANNELS):
-            MSG = "   fingerprinting channel %d/%d"
-            print(colored(MSG, attrs=["dark"]) % (channeln + 1, len(CHANNELS)))
-
-            matches.extend(find_matches(channel, FS, DB))
-
-            MSG = "   finished channel %d/%d, got %d hashes"
-            print(
-                colored(MSG, attrs=["dark"])
-                % (channeln + 1, len(CHANNELS), len(matches))
+        CACHE_FILE = get_cache_file(reader.parse_file_hash(), CONFIG)
+        CHANNEL_HASHES = load_cached_hashes(CACHE_FILE)
+
+        if CHANNEL_HASHES is None:
+            audio_data = reader.parse_audio()
+
+            CHANNELS = audio_data["channels"]
+            FS = audio_data["Fs"]
+            MSG = f" * loaded {CHANNELS.shape[1]} samples from file '{FILE_PATH}'"
+            print(colored(MSG, attrs=["dark"]))
+
+            # Channels are independent, so each one is fingerprinted in its
+            # own process; the database lookups stay in this process, on the
+            # open connection.
+            MSG = "   fingerprinting %d channel(s) in parallel"
+            print(colored(MSG, attrs=["dark"]) % len(CHANNELS))
+            with ProcessPoolExecutor(max_workers=len(CHANNELS)) as executor:
+                CHANNEL_HASHES = list(
+                    executor.map(fingerprint.fingerprint_channel, CHANNELS, repeat(FS))
+                )
+            save_cached_hashes(
+                CACHE_FILE,
+                CHANNEL_HASHES,
+                CONFIG.get("fingerprint.cache_max_mb", CACHE_MAX_MB) * 2**20,
             )
+        else:
+            MSG = f" * loaded cached fingerprints of file '{FILE_PATH}'"
+            print(colored(MSG, attrs=["dark"]))
+
+        matches = return_matches(CHANNEL_HASHES, DB)
 
         # Align matches and print the final result
-        TOTAL_MATCHES_FOUND = len(matches)
+        TOTAL_MATCHES_FOUND = int(matches[:, 2].sum())
         if TOTAL_MATCHES_FOUND > 0:
             MSG = " ** totally found %d hash matches"
             print(colored(MSG, "green") % TOTAL_MATCHES_FOUND)
 
-            if song := align_matches(matches, DB):
+            if candidates := align_matches(matches, DB):
+                song = candidates[0]
                 MSG = (
                     " => song: %s (id=%d)\n    offset: %d (%d secs)\n    confidence: %d"
                 )
@@ -199,6 +227,12 @@ if __name__ == "__main__":
                         song["CONFIDENCE"],
                     )
                 )
+                for song in candidates[1:]:
+                    MSG = "    runner-up: %s (id=%d), confidence: %d"
+                    print(
+                        colored(MSG, attrs=["dark"])
+                        % (song["SONG_NAME"], song["SONG_ID"], song["CONFIDENCE"])
+                    )
             else:
                 MSG = " ** no matches found in alignment"
                 print(colored(MSG, "red"))
@@ -6,6 +6,8 @@ matching the fingerprints against a database.
 """
 import argparse
 from argparse import RawTextHelpFormatter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from termcolor import colored
 
@@ -13,108 +15,11 @@ from libs.config import get_config
 from libs.db_sqlite import SqliteDatabase
 import libs.fingerprint as fingerprint
 from libs.reader_microphone import MicrophoneReader
-from libs.utils import grouper
+from libs.recognizer import align_matches, return_matches
 from libs.visualiser_console import VisualiserConsole as visual_peak
 from libs.visualiser_plot import VisualiserPlot as visual_plot
 
 
-def find_matches(db_conn, samples, fs=fingerprint.DEFAULT_FS):
-    """
-    Generates fingerprints for audio samples and queries the database for matches.
-
-    Args:
-        db_conn (SqliteDatabase): An active database connection.
-        samples (np.array): A numpy array of audio samples.
-        fs (int): The sample rate of the audio.
-
-    Yields:
-        tuple: A tuple of (song_id, offset_difference) for each match found.
-    """
-    hashes = fingerprint.fingerprint(samples, fs=fs)
-    return return_matches(db_conn, hashes)
-
-
-def return_matches(db_conn, hashes):
-    """
-    Looks up a list of hashes in the database.
-
-    Args:
-        db_conn (SqliteDatabase): An active database connection.
-        hashes (list): A list of (hash, offset) tuples.
-
-    Yields:
-        tuple: A tuple of (song_id, offset_difference) for each match found.
-    """
-    # Create a mapping of hash -> offset
-    mapper = {fp_hash.upper(): offset for fp_hash, offset in hashes}
-    values = list(mapper.keys())
-
-    for split_values in grouper(values, 1000):
-        placeholders = ", ".join("?" * len(split_values))
-        query = (
-            "SELECT upper(hash), song_fk, offset FROM fingerprints "
-            f"WHERE upper(hash) IN ({placeholders})"
-        )
-
-        db_matches = db_conn.execute_all(query, split_values)
-        matches_found = len(db_matches)
-
-        if matches_found > 0:
-            msg = f"   ** found {matches_found} hash matches"
-            print(colored(f"{msg} (step {len(split_values)}/{len(values)})", "green"))
-        else:
-            msg = f"   ** no matches found (step {len(split_values)}/{len(values)})"
-            print(colored(msg, "red"))
-
-        for fp_hash, sid, offset in db_matches:
-            # Return (song_id, database_offset - microphone_sample_offset)
-            yield (sid, offset - mapper[fp_hash])
-
-
-def align_matches(db_conn, matches):
-    """
-    Calculates the most likely song match from a list of hash matches.
-
-    Args:
-        db_conn (SqliteDatabase): An active database connection.
-        matches (list): A list of (song_id, offset_difference) tuples.
-
-    Returns:
-        dict: A dictionary containing the recognized song's information.
-    """
-    diff_counter = {}
-    largest_count = 0
-    song_id = -1
-    largest_offset = 0
-
-    for sid, diff in matches:
-        diff_counter.setdefault(diff, {})
-        diff_counter[diff].setdefault(sid, 0)
-        diff_counter[diff][sid] += 1
-
-        if diff_counter[diff][sid] > largest_count:
-            largest_offset = diff
-            largest_count = diff_counter[diff][sid]
-            song_id = sid
-
-    song_match_data = db_conn.get_song_by_id(song_id)
-    nseconds = round(
-        float(largest_offset)
-        / fingerprint.DEFAULT_FS
-        * fingerprint.DEFAULT_WINDOW_SIZE
-        * fingerprint.DEFAULT_OVERLAP_RATIO,
-        5,
-    )
-
-    return {
-        "SONG_ID": song_id,
-        "SONG_NAME": song_match_data[1] if song_match_data else "Unknown",
-        "CONFIDENCE": largest_count,
-        "OFFSET": int(largest_offset),
-        "OFFSET_SECS": nseconds,
-    }
-
-
 def _get_audio_settings(config):
     """Returns a dictionary with audio recording settings."""
     return {
@@ -177,28 +82,35 @@ def process_microphone_recording(db_conn, audio_settings, seconds_to_record):
         visual_plot.show(data)
 
     data = reader.get_recorded_data()
-    print(colored(f" * recorded {len(data[0])} samples", attrs=["dark"]))
+    print(colored(f" * recorded {data.shape[1]} samples", attrs=["dark"]))
 
-    matches = []
     channel_amount = len(data)
-    for channel_num, channel_samples in enumerate(data):
-        msg = f"   fingerprinting channel {channel_num + 1}/{channel_amount}"
-        print(colored(msg, attrs=["dark"]))
-        matches.extend(find_matches(db_conn, channel_samples))
-
-        msg = f"   finished channel {channel_num + 1}/{channel_amount}, "
-        msg += f"got {len(matches)} total matches"
-        print(colored(msg, attrs=["dark"]))
+    msg = f"   fingerprinting {channel_amount} channel(s) in parallel"
+    print(colored(msg, attrs=["dark"]))
+
+    # Channels are independent, so each one is fingerprinted in its own
+    # process; the database lookup stays in this process.
+    with ProcessPoolExecutor(max_workers=channel_amount) as executor:
+        channel_hashes = list(
+            executor.map(fingerprint.fingerprint_channel, data, repeat(reader.rate))
+        )
 
-    total_matches_found = len(matches)
+    matches = return_matches(channel_hashes, db_conn)
+    total_matches_found = int(matches[:, 2].sum())
     print("")
 
     if total_matches_found > 0:
         msg = f" ** totally found {total_matches_found} hash matches"
         print(colored(msg, "green"))
 
-        song = align_matches(db_conn, matches)
+        song, *runners_up = align_matches(matches, db_conn)
         print_song_result(song)
+        for other in runners_up:
+            msg = (
+                f"    runner-up: {other['SONG_NAME']} (id={other['SONG_ID']}), "
+                f"confidence: {other['CONFIDENCE']}"
+            )
+            print(colored(msg, attrs=["dark"]))
     else:
         print(colored(" ** no matches found at all", "red"))
 
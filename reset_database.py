@@ -1,7 +1,7 @@
 #!/usr/bin/python
 """
 This script resets the SQLite database by dropping and recreating the
-'songs' and 'fingerprints' tables.
+'songs' and 'fingerprints' tables and clearing the cache of scanned files.
 """
 from libs.db_sqlite import SqliteDatabase
 
@@ -10,30 +10,9 @@ if __name__ == "__main__":
         print("Dropping existing tables...")
         db.query("DROP TABLE IF EXISTS songs;")
         db.query("DROP TABLE IF EXISTS fingerprints;")
+        db.query("DROP TABLE IF EXISTS scanned_files;")
 
-        print("Creating new 'songs' table...")
-        db.query("""
-            CREATE TABLE songs (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              name TEXT,
-              filehash TEXT,
-              title TEXT,
-              artist TEXT,
-              album TEXT,
-              genre TEXT,
-              track INT,
-              duration INT
-            );
-        """)
-
-        print("Creating new 'fingerprints' table...")
-        db.query("""
-            CREATE TABLE fingerprints (
-              id INTEGER PRIMARY KEY AUTOINCREMENT,
-              song_fk INTEGER,
-              hash TEXT,
-              offset INTEGER
-            );
-        """)
+        print("Creating tables and indexes...")
+        db.create_schema()
 
         print("Database has been reset successfully.")
@@ -0,0 +1,86 @@
+"""Tests for the song collection script."""
+
+import os
+import tempfile
+import unittest
+
+from collect_fingerprints_of_songs import (
+    MIN_FILE_SIZE,
+    SongIndex,
+    fingerprint_song,
+    list_new_files,
+)
+from libs.db_sqlite import SqliteDatabase
+
+# Scanned files are created on tmpfs where there is one
+TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class TestCollectFingerprints(unittest.TestCase):
+    """Test suite for collecting songs into the database."""
+
+    def setUp(self):
+        """Opens an empty in-memory database for each test."""
+        self.database = SqliteDatabase(db_path=":memory:")
+        self.db = self.database.__enter__()
+        self.db.create_schema()
+
+    def tearDown(self):
+        """Closes the database of the test."""
+        self.database.__exit__(None, None, None)
+
+    def test_song_index_lookups(self):
+        """Test that indexed songs are found by file hash and by tags."""
+        db = self.db
+        metadata = {"title": "Title", "artist": "Artist", "track": "3"}
+        db.add_song("a.mp3", "hash1", metadata)
+        index = SongIndex(db)
+
+        self.assertEqual(index.filehashes(), frozenset({"hash1"}))
+        self.assertEqual(index.get_song_by_filehash("hash1")[1], "a.mp3")
+        self.assertEqual(index.get_song_by_tags(metadata)[1], "a.mp3")
+        self.assertIsNone(index.get_song_by_tags({**metadata, "artist": "Other"}))
+
+    def test_failed_insert_leaves_no_song(self):
+        """Test that a song whose fingerprints fail to store is not added."""
+        db = self.db
+        index = SongIndex(db)
+        # A hash too large for SQLite fails its insert chunk
+        hashes = [(h, h % 97) for h in range(2 * db.FINGERPRINT_CHUNK_SIZE)]
+        audio = {
+            "songname": "a",
+            "file_hash": "hash1",
+            "metadata": {},
+            "channel_hashes": [hashes + [(2**70, 0)]],
+        }
+
+        with self.assertRaises(OverflowError):
+            fingerprint_song(audio, db, index, "No")
+
+        self.assertEqual(db.get_all_songs(), [])
+        self.assertFalse(db.has_fingerprints())
+        self.assertEqual(index.filehashes(), frozenset())
+
+    def test_deleted_song_is_scanned_again(self):
+        """Test that a file is listed again once its song is deleted."""
+        db = self.db
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp_dir:
+            path = os.path.join(tmp_dir, "a.mp3")
+            with open(path, "wb") as f:
+                f.write(bytes(MIN_FILE_SIZE))
+            stat = os.stat(path)
+            song_id = db.add_song("a", "hash1", {})
+            db.mark_file_scanned(path, stat.st_mtime, stat.st_size, "hash1")
+
+            def new_files():
+                known = SongIndex(db).filehashes()
+                return list_new_files(tmp_dir, db.get_scanned_files(), known)
+
+            self.assertEqual(new_files(), [])
+
+            db.query(f"DELETE FROM {db.TABLE_SONGS} WHERE id = ?", [song_id])
+            self.assertEqual(new_files(), [(path, stat.st_mtime, stat.st_size)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""Tests for the fingerprinting pipeline."""
+
+import hashlib
+import unittest
+
+import numpy as np
+from matplotlib import mlab
+from scipy.ndimage import (
+    binary_erosion,
+    generate_binary_structure,
+    iterate_structure,
+    maximum_filter,
+)
+
+import libs.fingerprint as fingerprint
+
+
+def synthetic_signal(seconds=3, fs=fingerprint.DEFAULT_FS):
+    """Returns a fixed int16 signal of a few tones over noise."""
+    rng = np.random.default_rng(0)
+    t = np.arange(seconds * fs) / fs
+    tones = sum(
+        np.sin(2 * np.pi * freq * t) * (t % period < period / 2)
+        for freq, period in ((440, 0.5), (1250, 0.7), (3100, 0.3), (7000, 1.1))
+    )
+    signal = 5000 * tones + 300 * rng.standard_normal(len(t))
+    return signal.astype(np.int16)
+
+
+def log_spectrogram(samples):
+    """Returns the log spectrogram that fingerprint() searches for peaks."""
+    wsize = fingerprint.DEFAULT_WINDOW_SIZE
+    arr_2d = fingerprint.spectrogram(
+        samples,
+        fingerprint.DEFAULT_FS,
+        wsize,
+        int(wsize * fingerprint.DEFAULT_OVERLAP_RATIO),
+    )
+    with np.errstate(divide="ignore"):
+        arr_2d = 10 * np.log10(arr_2d)
+    arr_2d[np.isneginf(arr_2d)] = 0
+    return arr_2d
+
+
+def reference_peaks(arr_2d, amp_min=fingerprint.DEFAULT_AMP_MIN):
+    """Finds peaks with one pass of the whole 41x41 diamond."""
+    neighborhood = iterate_structure(
+        generate_binary_structure(2, 1), fingerprint.PEAK_NEIGHBORHOOD_SIZE
+    )
+    local_max = maximum_filter(arr_2d, footprint=neighborhood) == arr_2d
+    eroded_background = binary_erosion(
+        arr_2d == 0, structure=neighborhood, border_value=1
+    )
+    detected_peaks = (local_max ^ eroded_background) & (arr_2d > amp_min)
+    return np.argwhere(detected_peaks)
+
+
+def reference_hashes(peaks, fan_value=fingerprint.DEFAULT_FAN_VALUE):
+    """Pairs the peaks with a double loop, one hash at a time."""
+    peaks = sorted(map(tuple, peaks), key=lambda peak: peak[1])
+    hashes = []
+    for i, (freq1, t1) in enumerate(peaks):
+        for freq2, t2 in peaks[i + 1 : i + fan_value]:
+            t_delta = t2 - t1
+            if (
+                fingerprint.MIN_HASH_TIME_DELTA
+                <= t_delta
+                <= fingerprint.MAX_HASH_TIME_DELTA
+            ):
+                digest = hashlib.blake2b(
+                    fingerprint.HASH_INPUT.pack(freq1, freq2, t_delta),
+                    digest_size=fingerprint.FINGERPRINT_BYTES,
+                ).digest()
+                pair = (int.from_bytes(digest, "big", signed=True), t1)
+                if pair not in hashes:
+                    hashes.append(pair)
+    return hashes
+
+
+class TestFingerprint(unittest.TestCase):
+    """Test suite for the fingerprint module."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Computes the spectrogram of the synthetic signal once."""
+        cls.samples = synthetic_signal()
+        cls.arr_2d = log_spectrogram(cls.samples)
+
+    def test_spectrogram_matches_mlab(self):
+        """Test that the spectrogram matches matplotlib's specgram."""
+        wsize = fingerprint.DEFAULT_WINDOW_SIZE
+        noverlap = int(wsize * fingerprint.DEFAULT_OVERLAP_RATIO)
+        expected = mlab.specgram(
+            self.samples,
+            NFFT=wsize,
+            Fs=fingerprint.DEFAULT_FS,
+            window=mlab.window_hanning,
+            noverlap=noverlap,
+        )[0]
+
+        actual = fingerprint.spectrogram(
+            self.samples, fingerprint.DEFAULT_FS, wsize, noverlap
+        )
+        self.assertEqual(actual.shape, expected.shape)
+        # float32 precision, relative to the loudest bin
+        np.testing.assert_allclose(
+            actual, expected, rtol=1e-4, atol=1e-6 * expected.max()
+        )
+
+    def test_peaks_match_diamond_filter(self):
+        """Test that the cross passes find the peaks of the 41x41 diamond."""
+        peaks = fingerprint.get_2d_peaks(self.arr_2d)
+
+        self.assertGreater(len(peaks), 10)
+        np.testing.assert_array_equal(peaks, reference_peaks(self.arr_2d))
+
+    def test_hashes_match_double_loop(self):
+        """Test that the vectorized pairing yields the double loop's hashes."""
+        peaks = fingerprint.get_2d_peaks(self.arr_2d)
+
+        hashes = list(fingerprint.generate_hashes(peaks))
+        self.assertGreater(len(hashes), 10)
+        self.assertEqual(hashes, reference_hashes(peaks))
+
+    def test_fingerprint_of_signal(self):
+        """Test that fingerprint() hashes the peaks of its spectrogram."""
+        expected = reference_hashes(reference_peaks(self.arr_2d))
+
+        self.assertEqual(fingerprint.fingerprint_channel(self.samples), expected)
+
+    def test_no_peaks(self):
+        """Test that a silent spectrogram has no peaks and no hashes."""
+        peaks = fingerprint.get_2d_peaks(np.zeros((64, 32)))
+
+        self.assertEqual(peaks.shape, (0, 2))
+        self.assertEqual(list(fingerprint.generate_hashes(peaks)), [])
+
+    def test_single_peak(self):
+        """Test that a lone peak is found but cannot be paired."""
+        arr_2d = np.zeros((64, 32))
+        arr_2d[10, 5] = 50
+
+        peaks = fingerprint.get_2d_peaks(arr_2d)
+        np.testing.assert_array_equal(peaks, [[10, 5]])
+        self.assertEqual(list(fingerprint.generate_hashes(peaks)), [])
+
+    def test_short_signal(self):
+        """Test that a signal shorter than one window is still fingerprinted."""
+        arr_2d = log_spectrogram(self.samples[:1000])
+
+        self.assertEqual(arr_2d.shape, (fingerprint.DEFAULT_WINDOW_SIZE // 2 + 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
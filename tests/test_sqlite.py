@@ -1,11 +1,19 @@
 """Tests for the SQLite database functionality."""
 
-import sys
 import os
+import statistics
+import tempfile
+import time
 import unittest
+
+import numpy as np
+
 from libs.db_sqlite import SqliteDatabase
+from libs.recognizer import align_matches
 
-sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+# File-backed databases are created on tmpfs where there is one, so WAL mode
+# is exercised without disk I/O
+TMP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
 
 
 class TestSqliteDatabase(unittest.TestCase):
@@ -13,65 +21,287 @@ class TestSqliteDatabase(unittest.TestCase):
 
     TEST_DB_PATH = ":memory:"
 
-    def create_schema(self, db):
-        """Helper function to create the necessary tables."""
-        db.query(
-            """
-            CREATE TABLE songs (
-              id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, filehash TEXT,
-              title TEXT, artist TEXT, album TEXT, genre TEXT, track INT,
-              duration INT
-            );
-        """
-        )
-        db.query(
-            """
-            CREATE TABLE fingerprints (
-              id INTEGER PRIMARY KEY AUTOINCREMENT, song_fk INTEGER,
-              hash TEXT, offset INTEGER
-            );
-        """
-        )
+    @classmethod
+    def setUpClass(cls):
+        """Opens one in-memory database with the schema for every test."""
+        cls.database = SqliteDatabase(db_path=cls.TEST_DB_PATH)
+        cls.db = cls.database.__enter__()
+        cls.db.create_schema()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Closes the shared database."""
+        cls.database.__exit__(None, None, None)
+
+    def setUp(self):
+        """Starts a savepoint that undoes the writes of each test."""
+        self.db.query("SAVEPOINT test")
+
+    def tearDown(self):
+        """Restores the shared database to its state before the test."""
+        self.db.query("ROLLBACK TO test")
+        self.db.query("RELEASE test")
 
     def test_add_and_get_song(self):
         """Test that a song can be added and retrieved correctly."""
-        with SqliteDatabase(db_path=self.TEST_DB_PATH) as db:
-            self.create_schema(db)
+        db = self.db
+        filename = "test_song.mp3"
+        filehash = "test_hash_123"
+        metadata = {"title": "Test Title", "artist": "Test Artist"}
+
+        song_id = db.add_song(filename, filehash, metadata)
+        self.assertEqual(song_id, 1)
 
-            filename = "test_song.mp3"
-            filehash = "test_hash_123"
-            metadata = {"title": "Test Title", "artist": "Test Artist"}
+        retrieved_song = db.get_song_by_id(song_id)
+        self.assertIsNotNone(retrieved_song)
+        self.assertEqual(retrieved_song[1], filename)
+        self.assertEqual(retrieved_song["name"], filename)
 
-            song_id = db.add_song(filename, filehash, metadata)
-            self.assertEqual(song_id, 1)
+    def test_add_existing_song(self):
+        """Test that a known file hash or matching tags reuse the song ID."""
+        db = self.db
+        metadata = {"title": "Test Title", "artist": "Test Artist"}
+        song_id = db.add_song("test.mp3", "hash1", metadata)
 
-            retrieved_song = db.get_song_by_id(song_id)
-            self.assertIsNotNone(retrieved_song)
-            self.assertEqual(retrieved_song[1], filename)
+        self.assertEqual(db.add_song("copy.mp3", "hash1", {}), song_id)
+        self.assertEqual(db.add_song("tagged.mp3", "hash2", metadata), song_id)
+        self.assertNotEqual(db.add_song("other.mp3", "hash3", {}), song_id)
+        self.assertEqual(len(db.get_all_songs()), 2)
 
     def test_get_non_existent_song(self):
         """Test that querying for a non-existent song returns None."""
-        with SqliteDatabase(db_path=self.TEST_DB_PATH) as db:
-            self.create_schema(db)
-            retrieved_song = db.get_song_by_id(999)
-            self.assertIsNone(retrieved_song)
+        db = self.db
+        retrieved_song = db.get_song_by_id(999)
+        self.assertIsNone(retrieved_song)
+
+    def test_get_songs_by_ids(self):
+        """Test that several songs are retrieved by ID in one call."""
+        db = self.db
+        first = db.add_song("first.mp3", "hash1", {})
+        second = db.add_song("second.mp3", "hash2", {})
+
+        songs = db.get_songs_by_ids([second, first, 999])
+        self.assertEqual(sorted(songs), [first, second])
+        self.assertEqual(songs[second][1], "second.mp3")
+        self.assertEqual(db.get_songs_by_ids([]), {})
 
     def test_store_and_count_fingerprints(self):
         """Test that fingerprints can be stored and counted for a song."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+        self.assertEqual(song_id, 1)
+
+        fingerprints = [
+            (song_id, 111, 12),
+            (song_id, 222, 15),
+        ]
+        db.store_fingerprints(fingerprints)
+
+        count = db.get_song_hashes_count(song_id)
+        self.assertEqual(count, 2)
+
+    def test_store_duplicate_fingerprints(self):
+        """Test that a fingerprint stored twice is kept once."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+
+        db.store_fingerprints([(song_id, 111, 12), (song_id, 111, 12)])
+        db.store_fingerprints([(song_id, 111, 12)])
+
+        self.assertEqual(db.get_song_hashes_count(song_id), 1)
+
+    def test_store_fingerprints_in_chunks(self):
+        """Test that rows spanning several insert chunks are all stored."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+
+        rows = 2 * db.FINGERPRINT_CHUNK_SIZE + 7
+        db.store_fingerprints((song_id, h, h % 97) for h in range(rows))
+
+        self.assertEqual(db.get_song_hashes_count(song_id), rows)
+
+    @unittest.skipUnless(os.environ.get("RUN_PERF"), "set RUN_PERF to run")
+    def test_bulk_insert_scales_linearly(self):
+        """Test that ten times the fingerprints take about ten times as long."""
+        db = self.db
+
+        def insert_time(rows):
+            timings = []
+            for run in range(3):
+                # A new song per run, so no row is ignored as a duplicate
+                song_id = db.add_song(f"{rows}-{run}.mp3", f"{rows}-{run}", {})
+                # Scattered hashes, as the fingerprinter produces them
+                fingerprints = [
+                    (song_id, h * 2654435761 % 2**62, h % 97) for h in range(rows)
+                ]
+                start = time.perf_counter()
+                db.store_fingerprints(fingerprints)
+                self.assertEqual(db.get_song_hashes_count(song_id), rows)
+                timings.append(time.perf_counter() - start)
+            return statistics.median(timings)
+
+        self.assertLess(insert_time(10000) / insert_time(1000), 15)
+
+    def test_has_fingerprints(self):
+        """Test that the fingerprint check follows the first insert."""
+        db = self.db
+        self.assertFalse(db.has_fingerprints())
+
+        song_id = db.add_song("test.mp3", "hash1", {})
+        with self.assertRaises(RuntimeError):
+            with db.transaction():
+                db.store_fingerprints([(song_id, 111, 12)])
+                self.assertTrue(db.has_fingerprints())
+                raise RuntimeError("interrupted")
+        self.assertFalse(db.has_fingerprints())
+
+        db.store_fingerprints([(song_id, 111, 12)])
+        self.assertTrue(db.has_fingerprints())
+
+    def test_get_match_counts(self):
+        """Test that matches are counted per song and offset difference."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+        db.store_fingerprints(
+            [
+                (song_id, 111, 12),
+                (song_id, 222, 15),
+                (song_id, 333, 30),
+            ]
+        )
+
+        counts = db.get_match_counts([(111, 2), (222, 5), (333, 7)])
+        self.assertEqual(sorted(counts), [(song_id, 10, 2), (song_id, 23, 1)])
+
+    def test_get_match_counts_of_several_channels(self):
+        """Test that every channel counts its matches in a single lookup."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+        db.store_fingerprints([(song_id, 111, 12), (song_id, 222, 15)])
+
+        counts = db.get_match_counts([(111, 2), (222, 5)], [(111, 2), (222, 4)])
+        self.assertEqual(sorted(counts), [(song_id, 10, 3), (song_id, 11, 1)])
+
+    def test_align_matches_of_missing_song(self):
+        """Test that a match whose song row is gone is named Unknown."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
+        matches = np.array([[song_id, 10, 2], [999, 4, 5]], dtype=np.int64)
+
+        candidates = align_matches(matches, db)
+        self.assertEqual(
+            [(c["SONG_ID"], c["SONG_NAME"]) for c in candidates],
+            [(999, "Unknown"), (song_id, "test.mp3")],
+        )
+
+    def test_transaction_rolls_back_on_error(self):
+        """Test that a failed transaction leaves no partial writes behind."""
         with SqliteDatabase(db_path=self.TEST_DB_PATH) as db:
-            self.create_schema(db)
+            db.create_schema()
             song_id = db.add_song("test.mp3", "hash1", {})
-            self.assertEqual(song_id, 1)
 
-            fingerprints = [
-                (song_id, "fp_hash_1", 12),
-                (song_id, "fp_hash_2", 15),
-            ]
-            db.store_fingerprints(fingerprints)
+            with self.assertRaises(RuntimeError):
+                with db.transaction():
+                    db.store_fingerprints([(song_id, 111, 12)])
+                    raise RuntimeError("interrupted")
+
+            self.assertEqual(db.get_song_hashes_count(song_id), 0)
+            self.assertFalse(db.conn.in_transaction)
+
+    def test_nested_transaction_rolls_back_alone(self):
+        """Test that a failed nested block only undoes its own writes."""
+        db = self.db
+        song_id = db.add_song("test.mp3", "hash1", {})
 
-            count = db.get_song_hashes_count(song_id)
-            self.assertEqual(count, 2)
+        with db.transaction():
+            db.store_fingerprints([(song_id, 111, 12)])
+            with self.assertRaises(RuntimeError):
+                with db.transaction():
+                    db.store_fingerprints([(song_id, 222, 15)])
+                    raise RuntimeError("interrupted")
 
+        self.assertEqual(db.get_song_hashes_count(song_id), 1)
+
+    def test_nested_with_reuses_connection(self):
+        """Test that a nested block keeps the outer connection open."""
+        database = SqliteDatabase(db_path=self.TEST_DB_PATH)
+        with database as db:
+            db.create_schema()
+            conn = db.conn
+            with database as nested:
+                self.assertIs(nested.conn, conn)
+                nested.add_song("test.mp3", "hash1", {})
+
+            # The in-memory database would be gone had the connection closed
+            self.assertIsNotNone(db.get_song_by_id(1))
+
+    def test_pragmas_applied(self):
+        """Test that a file-backed database is opened in WAL mode."""
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp_dir:
+            db_path = os.path.join(tmp_dir, "test.db")
+            with SqliteDatabase(db_path=db_path) as db:
+                self.assertEqual(db.execute_one("PRAGMA journal_mode")[0], "wal")
+                # NORMAL
+                self.assertEqual(db.execute_one("PRAGMA synchronous")[0], 1)
+                # MEMORY
+                self.assertEqual(db.execute_one("PRAGMA temp_store")[0], 2)
+                self.assertEqual(db.execute_one("PRAGMA page_size")[0], 8192)
+
+    def test_writes_go_to_wal_file(self):
+        """Test that stored fingerprints are written to the WAL file first."""
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp_dir:
+            db_path = os.path.join(tmp_dir, "test.db")
+            with SqliteDatabase(db_path=db_path) as db:
+                db.create_schema()
+                song_id = db.add_song("test.mp3", "hash1", {})
+                db.store_fingerprints([(song_id, 111, 12)])
+
+                self.assertGreater(os.path.getsize(f"{db_path}-wal"), 0)
+
+    def test_old_sqlite_version_rejected(self):
+        """Test that connecting fails clearly on a too old SQLite library."""
+        database = SqliteDatabase(db_path=self.TEST_DB_PATH)
+        database.MIN_SQLITE_VERSION = (99, 0, 0)
+        with self.assertRaisesRegex(RuntimeError, "99.0.0 or later"):
+            database.__enter__()
+
+    def test_indexes_created_on_connect(self):
+        """Test that a database without indexes gets them when opened."""
+        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp_dir:
+            db_path = os.path.join(tmp_dir, "test.db")
+            with SqliteDatabase(db_path=db_path) as db:
+                db.query("CREATE TABLE songs (id INTEGER PRIMARY KEY, filehash TEXT)")
+                db.query(
+                    "CREATE TABLE fingerprints "
+                    "(song_fk INTEGER, hash INTEGER, offset INTEGER)"
+                )
+
+            with SqliteDatabase(db_path=db_path) as db:
+                indexes = {
+                    name
+                    for (name,) in db.execute_all(
+                        "SELECT name FROM sqlite_master WHERE type = 'index'"
+                    )
+                }
+
+            self.assertEqual(indexes, {"songs_filehash_idx"})
+
+    def test_scanned_files(self):
+        """Test that processed files are recorded and replaced by path."""
+        db = self.db
+        self.assertEqual(db.get_scanned_files(), {})
+
+        db.mark_file_scanned("mp3/a.mp3", 100.5, 2048, "hash1")
+        db.mark_file_scanned("mp3/a.mp3", 200.5, 4096, "hash2")
+        db.mark_file_scanned("mp3/b.mp3", 300.0, 1024, "hash2")
+
+        self.assertEqual(
+            db.get_scanned_files(),
+            {
+                "mp3/a.mp3": (200.5, 4096, "hash2"),
+                "mp3/b.mp3": (300.0, 1024, "hash2"),
+            },
+        )
 
 if __name__ == "__main__":
     unittest.main()